@@ -1,287 +1,665 @@
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-
-
-import argparse
-import json
-from pathlib import Path
-import sqlite3
-from noteslib import parseEntries, MARKDOWN_SUFFIX, TAG_NAMESPACE_SEPARATOR, UNTAGGED_TAG
-from watchdog.observers import Observer
-from watchdog.observers.polling import PollingObserver
-from watchdog.events import FileSystemEventHandler
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import unquote, urlparse
-
-
-DB_VERSION = "1_2"
-BACKLINKS_FILENAME = ".backlinks_v" + DB_VERSION + ".sqlite"
-
-
-class BacklinkEngine:
-    def __init__(self, notebookpath):
-        self.notebookpath = notebookpath
-        self.db_path = notebookpath / BACKLINKS_FILENAME
-        self._init_db()
-
-    def _init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS files (
-                    path TEXT PRIMARY KEY,
-                    last_mtime REAL
-                )
-            """)
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS backlinks (
-                    source TEXT,
-                    target TEXT,
-                    PRIMARY KEY (source, target)
-                )
-            """)
-
-    def get_backlinks(self, file_path):
-        results = []
-
-        lt = file_path
-        if lt.startswith("/"):
-            lt = lt[1:]
-        lt = (self.notebookpath / lt).relative_to(self.notebookpath).as_posix()
-        if lt.endswith(MARKDOWN_SUFFIX):
-            lt = lt[:-len(MARKDOWN_SUFFIX)]
-
-        lt = lt.replace("/", TAG_NAMESPACE_SEPARATOR).lower()
-
-
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("""
-                SELECT source FROM backlinks 
-                WHERE target = ?""", (lt, ))
-
-            results = [row[0] for row in cursor.fetchall()]
-
-        return sorted(results)
-
-    @staticmethod
-    def normalize_note_key(path):
-        norm = path
-        if norm.startswith("/"):
-            norm = norm[1:]
-        if norm.endswith(MARKDOWN_SUFFIX):
-            norm = norm[:-len(MARKDOWN_SUFFIX)]
-        return norm.replace("/", TAG_NAMESPACE_SEPARATOR).lower()
-
-    def get_graph_data(self):
-        with sqlite3.connect(self.db_path) as conn:
-            backlink_rows = conn.execute("SELECT source, target FROM backlinks").fetchall()
-            file_rows = conn.execute("SELECT path FROM files").fetchall()
-
-        normalized_files = {}
-        nodes = {}
-        edges = []
-
-        for (file_path,) in file_rows:
-            if file_path == UNTAGGED_TAG:
-                continue
-            node_id = self.normalize_note_key(file_path)
-            normalized_files[node_id] = file_path
-            nodes[node_id] = {
-                "id": node_id,
-                "label": file_path.lstrip("/"),
-                "title": file_path,
-                "group": "file"
-            }
-
-        for source, target in backlink_rows:
-            if source == UNTAGGED_TAG or target == UNTAGGED_TAG:
-                continue
-
-            source_id = self.normalize_note_key(source)
-            target_id = target
-
-            if source_id not in nodes:
-                nodes[source_id] = {
-                    "id": source_id,
-                    "label": source.lstrip("/"),
-                    "title": source,
-                    "group": "file"
-                }
-
-            if target_id not in nodes:
-                if target_id in normalized_files:
-                    nodes[target_id] = {
-                        "id": target_id,
-                        "label": normalized_files[target_id].lstrip("/"),
-                        "title": normalized_files[target_id],
-                        "group": "file"
-                    }
-                else:
-                    nodes[target_id] = {
-                        "id": target_id,
-                        "label": target_id,
-                        "title": target_id,
-                        "group": "tag"
-                    }
-
-            edges.append({"source": source_id, "target": target_id})
-
-        return {"nodes": list(nodes.values()), "edges": edges}
-
-    def extract_links(self, file_path):
-        parsedEntries = parseEntries(thepath=file_path, notebookpath=self.notebookpath)
-        links = set()
-        for t in parsedEntries["prefixTags"]:
-            links.add(t)
-
-        for e in parsedEntries["entries"]:
-            for t in e["tags"]:
-                links.add(t)
-
-        return links
-
-    def sync_file(self, file_path: Path):
-        """Updates or adds file links to the DB."""
-        if not file_path.exists():
-            self.remove_file(file_path)
-            return
-
-        mtime = file_path.stat().st_mtime
-
-        with sqlite3.connect(self.db_path) as conn:
-            abs_path = "/" + (self.notebookpath / file_path).relative_to(self.notebookpath).as_posix()
-            cursor = conn.execute("SELECT last_mtime FROM files WHERE path = ?", (abs_path,))
-            row = cursor.fetchone()
-
-            if row and row[0] >= mtime:
-                return 
-
-            links = self.extract_links(file_path)
-            conn.execute("DELETE FROM backlinks WHERE source = ?", (abs_path,))
-            for link in links:
-                conn.execute("INSERT OR IGNORE INTO backlinks (source, target) VALUES (?, ?)", 
-                             (abs_path, link.lower()))
-
-            conn.execute("INSERT OR REPLACE INTO files (path, last_mtime) VALUES (?, ?)", 
-                         (abs_path, mtime))
-            print(f"🔄 Synced: {abs_path}")
-
-    def remove_file(self, file_path: Path):
-        """Removes file and its associated links from the DB."""
-        abs_path = "/" + (self.notebookpath / file_path).relative_to(self.notebookpath).as_posix()
-
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("DELETE FROM files WHERE path = ?", (abs_path,))
-            conn.execute("DELETE FROM backlinks WHERE source = ?", (abs_path,))
-        print(f"🗑️ Removed: {file_path.name}")
-
-    def catch_up(self):
-        print("🔍 Scanning for changes...")
-
-        # Update or add existing files
-        for md_file in self.notebookpath.rglob("*" + MARKDOWN_SUFFIX):
-            self.sync_file(md_file)
-
-        # Clean up files that were deleted while the script was away
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("SELECT path FROM files")
-            stored_paths = [row[0] for row in cursor.fetchall()]
-
-            for path_str in stored_paths:
-                if path_str.startswith("/"):
-                    path_str = "." + path_str
-                path_file = self.notebookpath / path_str
-                if not path_file.exists():
-                    self.remove_file(path_file)
-
-        print("✅ Catch-up complete.")
-
-
-class MarkdownHandler(FileSystemEventHandler):
-    def __init__(self, engine: BacklinkEngine):
-        self.engine = engine
-
-    def on_modified(self, event):
-        if not event.is_directory and event.src_path.endswith(MARKDOWN_SUFFIX):
-            self.engine.sync_file(Path(event.src_path))
-
-    def on_created(self, event):
-        if not event.is_directory and event.src_path.endswith(MARKDOWN_SUFFIX):
-            self.engine.sync_file(Path(event.src_path))
-
-    def on_deleted(self, event):
-        if not event.is_directory and event.src_path.endswith(MARKDOWN_SUFFIX):
-            self.engine.remove_file(Path(event.src_path))
-
-
-def backlink_handler_factory(engine):
-    class BacklinkHandler(BaseHTTPRequestHandler):
-        def send_json(self, payload):
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(json.dumps(payload).encode('utf-8'))
-
-        def send_html(self, html):
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(html.encode('utf-8'))
-
-        def do_GET(self):
-            parsed_url = urlparse(self.path)
-            path = unquote(parsed_url.path)
-
-            # Graph data
-            if path == '/__graph__data__':
-                self.send_json(engine.get_graph_data())
-                return
-
-            # Backlink lookup
-            target_path = path.lstrip('/')
-            if not target_path:
-                self.send_error(400, "Bad Request: Please provide a path (e.g., /file.md)")
-                return
-
-            response = engine.get_backlinks(target_path)
-            self.send_json(response)
-
-    return BacklinkHandler
-
-
-def main(notebookpath, host, port, use_polling):
-    engine = BacklinkEngine(notebookpath=notebookpath)
-    engine.catch_up()
-
-    event_handler = MarkdownHandler(engine)
-    observer = PollingObserver(timeout=5) if use_polling else Observer()
-    observer.schedule(event_handler, notebookpath, recursive=True)
-
-    print(f"Monitoring {notebookpath}...")
-    observer.start()
-
-    print(f"Serving backlinks on {host}:{port}...")
-    handler_class = backlink_handler_factory(engine=engine)
-    server = HTTPServer((host, port), handler_class)
-
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        server.server_close()
-        observer.stop()
-
-    observer.join()
-
-
-if __name__ == "__main__":
-
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--notebookpath")
-    parser.add_argument("--polling", action="store_true")
-    parser.add_argument("--port", default=5001, type=int)
-    args = parser.parse_args()
-    notebookpath = Path(args.notebookpath).resolve()
-
-    host = '127.0.0.1'
-    main(notebookpath=notebookpath, host=host, port=args.port, use_polling=args.polling)
-
-
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+try:
+    from .noteslib import iterEntries, linkTag, parseFiles, MARKDOWN_SUFFIX, IMAGE_OR_LINK_REGEX, TAG_NAMESPACE_SEPARATOR, TAG_REGEX, UNTAGGED_TAG
+except ImportError:   # run as a script
+    from noteslib import iterEntries, linkTag, parseFiles, MARKDOWN_SUFFIX, IMAGE_OR_LINK_REGEX, TAG_NAMESPACE_SEPARATOR, TAG_REGEX, UNTAGGED_TAG
+try:
+    from watchdog.observers import Observer
+    from watchdog.observers.polling import PollingObserver
+    from watchdog.events import FileSystemEventHandler
+except ImportError:   # only needed for monitoring; notesserver reads the database without it (BacklinkEngine(readonly=True))
+    Observer = PollingObserver = None
+    FileSystemEventHandler = object
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote, urlparse
+
+
+DB_VERSION = "2"
+BACKLINKS_FILENAME = ".backlinks_v" + DB_VERSION + ".sqlite"
+LEGACY_BACKLINKS_FILENAME = ".backlinks_v1_2.sqlite"   # imported into a new database by _migrate_legacy_db, then removed
+DEFAULT_DEBOUNCE = 0.5   # seconds without file events before the queued files are synced, see SyncQueue
+MAX_SYNC_DELAY = 5.0   # seconds after which queued files are synced even if events keep coming
+
+
+class BacklinkEngine:
+    def __init__(self, notebookpath, workers=None, readonly=False):
+        self.notebookpath = notebookpath
+        self.workers = workers   # processes for parsing changed files in catch_up (see noteslib.parseFiles)
+        self.db_path = notebookpath / BACKLINKS_FILENAME
+        self.readonly = readonly   # only get_backlinks and get_graph_data, e.g. in notesserver while backlinkmonitor keeps the database current
+        self._local = threading.local()
+        if not readonly:
+            self._init_db()
+
+    def _connection(self):
+        # persistent connection of the current thread; read-only engines never create or write the database
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.readonly:
+                conn = sqlite3.connect(self.db_path.as_uri() + "?mode=ro", uri=True)
+            else:
+                conn = sqlite3.connect(self.db_path)
+                conn.execute("PRAGMA synchronous=NORMAL")   # with WAL, a crash may lose the last syncs, which catch_up redoes
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        # paths and tags are stored once (files, tags) and referenced by their ids; backlinks_target serves get_backlinks
+        created = not self.db_path.exists()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")   # readers (notesserver) are not blocked while files are synced
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    last_mtime REAL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tags (
+                    id INTEGER PRIMARY KEY,
+                    tag TEXT UNIQUE NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS backlinks (
+                    source INTEGER NOT NULL,
+                    target INTEGER NOT NULL,
+                    PRIMARY KEY (source, target)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS backlinks_target ON backlinks (target, source)")
+
+        if created:
+            self._migrate_legacy_db(conn)
+
+    def _migrate_legacy_db(self, conn):
+        # imports the files and links of a version 1_2 database, so that catch_up only needs to sync what changed since
+        legacy_path = self.notebookpath / LEGACY_BACKLINKS_FILENAME
+        if not legacy_path.exists():
+            return
+
+        conn.execute("ATTACH DATABASE ? AS legacy", (legacy_path.as_posix(),))
+        try:
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO files (path, last_mtime) SELECT path, last_mtime FROM legacy.files")
+                conn.execute("INSERT OR IGNORE INTO tags (tag) SELECT DISTINCT target FROM legacy.backlinks")
+                conn.execute("""
+                    INSERT OR IGNORE INTO backlinks (source, target)
+                    SELECT files.id, tags.id FROM legacy.backlinks
+                    JOIN files ON files.path = legacy.backlinks.source
+                    JOIN tags ON tags.tag = legacy.backlinks.target
+                """)
+        finally:
+            conn.execute("DETACH DATABASE legacy")
+
+        legacy_path.unlink()
+        print(f"📦 Migrated {LEGACY_BACKLINKS_FILENAME} to {BACKLINKS_FILENAME}")
+
+    def _note_path(self, file_path):
+        # the path of file_path as stored in files.path, e.g. "/folder/note.md"
+        return "/" + (self.notebookpath / file_path).relative_to(self.notebookpath).as_posix()
+
+    def get_backlinks(self, file_path):
+        results = []
+
+        lt = file_path
+        if lt.startswith("/"):
+            lt = lt[1:]
+        lt = (self.notebookpath / lt).relative_to(self.notebookpath).as_posix()
+        if lt.endswith(MARKDOWN_SUFFIX):
+            lt = lt[:-len(MARKDOWN_SUFFIX)]
+
+        lt = lt.replace("/", TAG_NAMESPACE_SEPARATOR).lower()
+
+
+        cursor = self._connection().execute("""
+            SELECT files.path FROM tags
+            JOIN backlinks ON backlinks.target = tags.id
+            JOIN files ON files.id = backlinks.source
+            WHERE tags.tag = ?""", (lt, ))
+
+        results = [row[0] for row in cursor.fetchall()]
+
+        return sorted(results)
+
+    @staticmethod
+    def normalize_note_key(path):
+        norm = path
+        if norm.startswith("/"):
+            norm = norm[1:]
+        if norm.endswith(MARKDOWN_SUFFIX):
+            norm = norm[:-len(MARKDOWN_SUFFIX)]
+        return norm.replace("/", TAG_NAMESPACE_SEPARATOR).lower()
+
+    def get_graph_data(self):
+        conn = self._connection()
+        backlink_rows = conn.execute("""
+            SELECT files.path, tags.tag FROM backlinks
+            JOIN files ON files.id = backlinks.source
+            JOIN tags ON tags.id = backlinks.target""").fetchall()
+        file_rows = conn.execute("SELECT path FROM files").fetchall()
+
+        normalized_files = {}
+        nodes = {}
+        edges = []
+
+        for (file_path,) in file_rows:
+            if file_path == UNTAGGED_TAG:
+                continue
+            node_id = self.normalize_note_key(file_path)
+            normalized_files[node_id] = file_path
+            nodes[node_id] = {
+                "id": node_id,
+                "label": file_path.lstrip("/"),
+                "title": file_path,
+                "group": "file"
+            }
+
+        for source, target in backlink_rows:
+            if source == UNTAGGED_TAG or target == UNTAGGED_TAG:
+                continue
+
+            source_id = self.normalize_note_key(source)
+            target_id = target
+
+            if source_id not in nodes:
+                nodes[source_id] = {
+                    "id": source_id,
+                    "label": source.lstrip("/"),
+                    "title": source,
+                    "group": "file"
+                }
+
+            if target_id not in nodes:
+                if target_id in normalized_files:
+                    nodes[target_id] = {
+                        "id": target_id,
+                        "label": normalized_files[target_id].lstrip("/"),
+                        "title": normalized_files[target_id],
+                        "group": "file"
+                    }
+                else:
+                    nodes[target_id] = {
+                        "id": target_id,
+                        "label": target_id,
+                        "title": target_id,
+                        "group": "tag"
+                    }
+
+            edges.append({"source": source_id, "target": target_id})
+
+        return {"nodes": list(nodes.values()), "edges": edges}
+
+    def extract_links(self, file_path):
+        prefixTags = {}
+        entries = iterEntries(thepath=file_path, notebookpath=self.notebookpath, headers_only=True, prefixTags=prefixTags)
+        return self.links_of(entries=entries, prefixTags=prefixTags)
+
+    @staticmethod
+    def links_of(entries, prefixTags):
+        links = set()
+        for e in entries:
+            for t in e["tags"]:
+                links.add(t)
+
+        if len(prefixTags) == 0:
+            links.add(UNTAGGED_TAG)
+        for t in prefixTags:
+            links.add(t)
+
+        return links
+
+    def sync_file(self, file_path: Path, links=None):
+        """Updates or adds file links to the DB (links: the links of the file, if already extracted)."""
+        if not file_path.exists():
+            self.remove_file(file_path)
+            return
+
+        mtime = file_path.stat().st_mtime
+
+        conn = self._connection()
+        abs_path = self._note_path(file_path)
+        row = conn.execute("SELECT id, last_mtime FROM files WHERE path = ?", (abs_path,)).fetchone()
+
+        if row and row[1] >= mtime:
+            return
+
+        if links is None:
+            links = self.extract_links(file_path)
+
+        with conn:   # one transaction per file
+            self._store_links(conn, abs_path=abs_path, mtime=mtime, links=links, row=row)
+        print(f"🔄 Synced: {abs_path}")
+
+    def sync_files(self, file_paths):
+        """Like sync_file for each of file_paths, but parses the changed files in parallel and writes all of them in one transaction.
+
+        Returns the number of files that were updated or removed.
+        """
+        conn = self._connection()
+        removed = []
+        changed = {}
+        for file_path in file_paths:
+            abs_path = self._note_path(file_path)
+            try:
+                mtime = file_path.stat().st_mtime
+            except FileNotFoundError:
+                removed.append(abs_path)
+                continue
+            row = conn.execute("SELECT id, last_mtime FROM files WHERE path = ?", (abs_path,)).fetchone()
+            if row is None or row[1] < mtime:
+                changed[file_path] = (abs_path, mtime, row)
+
+        parsed = [(md_file, self.links_of(entries=entries, prefixTags=prefixTags))
+                  for md_file, entries, prefixTags in parseFiles(paths=list(changed), notebookpath=self.notebookpath, headers_only=True, workers=self.workers)]
+
+        with conn:
+            for abs_path in removed:
+                self._delete_file(conn, abs_path=abs_path)
+            for md_file, links in parsed:
+                abs_path, mtime, row = changed[md_file]
+                self._store_links(conn, abs_path=abs_path, mtime=mtime, links=links, row=row)
+
+        return len(removed) + len(parsed)
+
+    @staticmethod
+    def _store_links(conn, abs_path, mtime, links, row):
+        # replaces the links of abs_path (row: its (id, last_mtime) in files, or None), within the caller's transaction
+        targets = [(link,) for link in {link.lower() for link in links}]
+        if row is None:
+            file_id = conn.execute("INSERT INTO files (path, last_mtime) VALUES (?, ?)", (abs_path, mtime)).lastrowid
+        else:
+            file_id = row[0]
+            conn.execute("UPDATE files SET last_mtime = ? WHERE id = ?", (mtime, file_id))
+            conn.execute("DELETE FROM backlinks WHERE source = ?", (file_id,))
+
+        conn.executemany("INSERT OR IGNORE INTO tags (tag) VALUES (?)", targets)
+        conn.executemany("INSERT OR IGNORE INTO backlinks (source, target) SELECT ?, id FROM tags WHERE tag = ?",
+                         [(file_id, target) for (target,) in targets])
+
+    @staticmethod
+    def _delete_file(conn, abs_path):
+        conn.execute("DELETE FROM backlinks WHERE source = (SELECT id FROM files WHERE path = ?)", (abs_path,))
+        conn.execute("DELETE FROM files WHERE path = ?", (abs_path,))
+
+    def remove_file(self, file_path: Path):
+        """Removes file and its associated links from the DB."""
+        abs_path = self._note_path(file_path)
+
+        conn = self._connection()
+        with conn:
+            self._delete_file(conn, abs_path=abs_path)
+        print(f"🗑️ Removed: {file_path.name}")
+
+    def move(self, src_path: Path, dest_path: Path, is_directory=False):
+        """Moves the synced file src_path, or all synced files below the directory src_path, to dest_path.
+
+        The paths are rewritten in place (one UPDATE for a whole directory) and the links of the moved files
+        to the moved note or folder itself are re-pointed to its new location, e.g. relative links between the
+        notes of a moved folder. The files are not parsed again: each one is only checked (see
+        _links_follow_move) to have no links that resolve differently otherwise, e.g. relative links out of
+        the moved folder. Files that do, or that changed since they were synced, are marked as outdated.
+
+        Returns the files (at their new location) that still need to be synced, see sync_files.
+        """
+        conn = self._connection()
+        src = self._note_path(src_path)
+        dest = self._note_path(dest_path)
+        if src == dest:
+            return []
+        params = {"src": src, "dest": dest, "src_length": len(src)}
+        if is_directory:
+            # the paths below a folder sort between folder + "/" and folder + "0" ("0" follows "/"), which the files.path index finds
+            params.update(src_from=src + "/", src_to=src + "0", dest_from=dest + "/", dest_to=dest + "0")
+            src_match = "path >= :src_from AND path < :src_to"
+            dest_match = "path >= :dest_from AND path < :dest_to"
+            # links to anything below the folder move with it; the trailing separator keeps "folder" from matching "folder2"
+            old_key = self.normalize_note_key(src) + TAG_NAMESPACE_SEPARATOR
+            new_key = self.normalize_note_key(dest) + TAG_NAMESPACE_SEPARATOR
+            tag_match = "substr(tag, 1, :old_length) = :old_key"
+            moves_tag = lambda tag: tag.startswith(old_key)
+        else:
+            src_match = "path = :src"
+            dest_match = "path = :dest"
+            old_key = self.normalize_note_key(src)
+            new_key = self.normalize_note_key(dest)
+            tag_match = "tag = :old_key"
+            moves_tag = lambda tag: tag == old_key
+        params.update(old_key=old_key, new_key=new_key, old_length=len(old_key))
+
+        rows = conn.execute(f"SELECT id, path, last_mtime FROM files WHERE {src_match}", params).fetchall()
+        if len(rows) == 0:   # e.g. not synced yet, or already moved along with its folder; watchdog reports the files of a moved folder, too
+            return [] if is_directory else [dest_path]
+
+        outdated = []
+        for file_id, path, last_mtime in rows:
+            old_file = self.notebookpath / path[1:]
+            new_file = self.notebookpath / (dest + path[len(src):])[1:]
+            try:
+                if new_file.stat().st_mtime > last_mtime or not self._links_follow_move(
+                        old_file=old_file, new_file=new_file, moves_tag=moves_tag, old_key=old_key, new_key=new_key):
+                    outdated.append((file_id, new_file))
+            except (OSError, UnicodeDecodeError, ValueError):   # e.g. moved again already, or a link out of the notebook
+                outdated.append((file_id, new_file))
+
+        with conn:
+            # whatever was synced at the destination has been replaced
+            conn.execute(f"DELETE FROM backlinks WHERE source IN (SELECT id FROM files WHERE {dest_match})", params)
+            conn.execute(f"DELETE FROM files WHERE {dest_match}", params)
+
+            conn.execute(f"UPDATE files SET path = :dest || substr(path, :src_length + 1) WHERE {src_match}", params)
+
+            moved_ids = f"SELECT id FROM files WHERE {dest_match}"
+            conn.execute(f"""
+                INSERT OR IGNORE INTO tags (tag)
+                SELECT :new_key || substr(tag, :old_length + 1) FROM tags
+                WHERE {tag_match} AND id IN (SELECT target FROM backlinks WHERE source IN ({moved_ids}))""", params)
+            conn.execute(f"""
+                UPDATE OR REPLACE backlinks
+                SET target = (SELECT moved.id FROM tags AS old JOIN tags AS moved ON moved.tag = :new_key || substr(old.tag, :old_length + 1)
+                              WHERE old.id = backlinks.target)
+                WHERE source IN ({moved_ids}) AND target IN (SELECT id FROM tags WHERE {tag_match})""", params)
+
+            # parsed again by the next sync_files, or by catch_up should that not happen
+            conn.executemany("UPDATE files SET last_mtime = 0 WHERE id = ?", [(file_id,) for file_id, _ in outdated])
+
+        print(f"🚚 Moved: {src} → {dest} ({len(rows)} files, {len(outdated)} to parse again)")
+        return [new_file for _, new_file in outdated]
+
+    def _links_follow_move(self, old_file, new_file, moves_tag, old_key, new_key):
+        # whether re-pointing the links of new_file that move (moves_tag) from old_key to new_key gives the links
+        # parsing it at its new location would: each distinct link is resolved once, tags only matter if they would move
+        thelinks = set()
+        with open(new_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if "](" in line:
+                    thelinks.update(thelink for image, _, thelink in IMAGE_OR_LINK_REGEX.findall(line) if len(image) == 0)
+                if old_key in line.lower() and any(moves_tag(tag.lower()) for _, tag in TAG_REGEX.findall(line)):
+                    return False
+
+        for thelink in thelinks:
+            old_link = linkTag(thelink, notebookpath=self.notebookpath, originPath=old_file.parent).lower()
+            new_link = linkTag(thelink, notebookpath=self.notebookpath, originPath=new_file.parent).lower()
+            if (new_key + old_link[len(old_key):] if moves_tag(old_link) else old_link) != new_link:
+                return False
+        return True
+
+    def catch_up(self):
+        print("🔍 Scanning for changes...")
+
+        synced = dict(self._connection().execute("SELECT path, last_mtime FROM files").fetchall())
+
+        # Update or add existing files
+        changed = []
+        for md_file in self.notebookpath.rglob("*" + MARKDOWN_SUFFIX):
+            last_mtime = synced.pop(self._note_path(md_file), None)
+            if last_mtime is None or last_mtime < md_file.stat().st_mtime:
+                changed.append(md_file)
+
+        # Clean up files that were deleted while the script was away
+        for path_str in synced:
+            if path_str.startswith("/"):
+                path_str = "." + path_str
+            changed.append(self.notebookpath / path_str)
+
+        count = self.sync_files(changed)
+        print(f"✅ Catch-up complete, {count} files synced.")
+
+
+class SyncQueue:
+    """Queue of files to sync, coalesced by path and synced in batches on a worker thread.
+
+    Files are taken from the queue once no event arrived for `debounce` seconds, or once the oldest
+    queued event is MAX_SYNC_DELAY seconds old. The several events an editor fires per save, or the
+    thousands of a checkout, are thereby synced once per file, in one transaction per batch (see
+    BacklinkEngine.sync_files). Whether a file was created, modified or deleted is checked when syncing.
+    Moves are applied first, in the order they happened (see BacklinkEngine.move).
+    """
+
+    def __init__(self, engine: BacklinkEngine, debounce=DEFAULT_DEBOUNCE):
+        self.engine = engine
+        self.debounce = debounce
+        self._pending = {}   # paths to sync (an ordered set)
+        self._moves = []   # (src_path, dest_path, is_directory)
+        self._first_event = None   # monotonic time of the first event since the queue was last taken
+        self._last_event = 0.0
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="backlinks-sync", daemon=True)
+        self.events = 0
+        self.batches = 0
+        self.synced = 0
+        self.moves = 0
+        self.last_batch = None   # {"files", "moves", "synced", "seconds", "latency"} of the last batch
+        self.max_latency = 0.0
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Syncs the queued files and stops the worker thread."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def put(self, file_path: Path):
+        with self._cond:
+            self._pending[file_path] = None
+            self._queued()
+
+    def move(self, src_path: Path, dest_path: Path, is_directory=False):
+        with self._cond:
+            self._moves.append((src_path, dest_path, is_directory))
+            # files queued before the move are synced at their new location
+            self._pending = dict.fromkeys(_moved_path(file_path, src_path=src_path, dest_path=dest_path) for file_path in self._pending)
+            self._queued()
+
+    def _queued(self):
+        # called with self._cond held
+        now = time.monotonic()
+        if self._first_event is None:
+            self._first_event = now
+        self._last_event = now
+        self.events += 1
+        self._cond.notify()
+
+    def _take_batch(self):
+        # waits until the queued events are due, returns (moves, paths, time of the first event), or None once stopped and drained
+        with self._cond:
+            while True:
+                if self._first_event is not None:
+                    due = min(self._last_event + self.debounce, self._first_event + MAX_SYNC_DELAY)
+                    now = time.monotonic()
+                    if self._stopped or now >= due:
+                        batch = (self._moves, list(self._pending), self._first_event)
+                        self._moves = []
+                        self._pending = {}
+                        self._first_event = None
+                        return batch
+                    self._cond.wait(timeout=due - now)
+                elif self._stopped:
+                    return None
+                else:
+                    self._cond.wait()
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+
+            moves, paths, first_event = batch
+            started = time.monotonic()
+            for src_path, dest_path, is_directory in moves:
+                try:
+                    paths.extend(self.engine.move(src_path, dest_path, is_directory=is_directory))
+                except Exception as e:
+                    print(f"⚠️ Failed to move {src_path} to {dest_path} ({e}), syncing both")
+                    paths.append(src_path)   # removes the file, though not the files of a folder: catch_up does on the next start
+                    paths.extend(sorted(dest_path.rglob("*" + MARKDOWN_SUFFIX)) if is_directory else [dest_path])
+            paths = list(dict.fromkeys(paths))
+
+            try:
+                synced = self.engine.sync_files(paths)
+            except Exception as e:   # e.g. the database is locked: don't lose the whole batch, or the worker thread
+                print(f"⚠️ Syncing {len(paths)} files at once failed ({e}), syncing them one by one")
+                synced = 0
+                for file_path in paths:
+                    try:
+                        self.engine.sync_file(file_path)
+                        synced += 1
+                    except Exception as e:
+                        print(f"⚠️ Failed to sync {file_path}: {e}")
+            finished = time.monotonic()
+
+            latency = finished - first_event   # from the first event to the commit
+            with self._cond:
+                self.batches += 1
+                self.synced += synced
+                self.moves += len(moves)
+                self.last_batch = {"files": len(paths), "moves": len(moves), "synced": synced, "seconds": finished - started, "latency": latency}
+                self.max_latency = max(self.max_latency, latency)
+            print(f"🔄 Synced {synced} of {len(paths)} queued files" + (f" after {len(moves)} moves" if len(moves) != 0 else "") +
+                  f" in {(finished - started) * 1000:.0f} ms, {latency * 1000:.0f} ms after the first event")
+
+    def stats(self):
+        with self._cond:
+            return {"queued": len(self._pending), "queued_moves": len(self._moves), "events": self.events, "batches": self.batches,
+                    "synced": self.synced, "moves": self.moves, "last_batch": self.last_batch, "max_latency": self.max_latency}
+
+
+def _moved_path(file_path, src_path, dest_path):
+    # where file_path is after moving src_path (a file or a folder) to dest_path
+    if file_path == src_path:
+        return dest_path
+    if file_path.is_relative_to(src_path):
+        return dest_path / file_path.relative_to(src_path)
+    return file_path
+
+
+class MarkdownHandler(FileSystemEventHandler):
+    def __init__(self, queue: SyncQueue):
+        self.queue = queue
+
+    def on_modified(self, event):
+        if not event.is_directory and event.src_path.endswith(MARKDOWN_SUFFIX):
+            self.queue.put(Path(event.src_path))
+
+    def on_created(self, event):
+        if not event.is_directory and event.src_path.endswith(MARKDOWN_SUFFIX):
+            self.queue.put(Path(event.src_path))
+
+    def on_deleted(self, event):
+        if not event.is_directory and event.src_path.endswith(MARKDOWN_SUFFIX):
+            self.queue.put(Path(event.src_path))
+
+    def on_moved(self, event):
+        if event.is_directory or (event.src_path.endswith(MARKDOWN_SUFFIX) and event.dest_path.endswith(MARKDOWN_SUFFIX)):
+            self.queue.move(Path(event.src_path), Path(event.dest_path), is_directory=event.is_directory)
+            return
+
+        # e.g. an editor saving to a temporary file and renaming it to the note
+        if event.src_path.endswith(MARKDOWN_SUFFIX):
+            self.queue.put(Path(event.src_path))
+        if event.dest_path.endswith(MARKDOWN_SUFFIX):
+            self.queue.put(Path(event.dest_path))
+
+
+def backlink_handler_factory(engine, queue=None):
+    class BacklinkHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive, so that notesserver can reuse its connections
+        disable_nagle_algorithm = True   # headers and body are written separately; don't hold the body back until the headers are acknowledged
+
+        def send_body(self, body, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, payload):
+            self.send_body(json.dumps(payload).encode('utf-8'), 'application/json; charset=utf-8')
+
+        def send_html(self, html):
+            self.send_body(html.encode('utf-8'), 'text/html; charset=utf-8')
+
+        def do_GET(self):
+            parsed_url = urlparse(self.path)
+            path = unquote(parsed_url.path)
+
+            # Graph data
+            if path == '/__graph__data__':
+                self.send_json(engine.get_graph_data())
+                return
+
+            # Sync queue statistics
+            if path == '/__stats__':
+                self.send_json({"queue": None if queue is None else queue.stats()})
+                return
+
+            # Backlink lookup
+            target_path = path.lstrip('/')
+            if not target_path:
+                self.send_error(400, "Bad Request: Please provide a path (e.g., /file.md)")
+                return
+
+            response = engine.get_backlinks(target_path)
+            self.send_json(response)
+
+    return BacklinkHandler
+
+
+def main(notebookpath, host, port, use_polling, workers, debounce=DEFAULT_DEBOUNCE):
+    engine = BacklinkEngine(notebookpath=notebookpath, workers=workers)
+    engine.catch_up()
+
+    queue = SyncQueue(engine=engine, debounce=debounce)
+    queue.start()
+    event_handler = MarkdownHandler(queue)
+    observer = PollingObserver(timeout=5) if use_polling else Observer()
+    observer.schedule(event_handler, notebookpath, recursive=True)
+
+    print(f"Monitoring {notebookpath}...")
+    observer.start()
+
+    print(f"Serving backlinks on {host}:{port}...")
+    handler_class = backlink_handler_factory(engine=engine, queue=queue)
+    server = ThreadingHTTPServer((host, port), handler_class)   # a thread per (keep-alive) connection
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        observer.stop()
+
+    observer.join()
+    queue.stop()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notebookpath")
+    parser.add_argument("--polling", action="store_true")
+    parser.add_argument("--port", default=5001, type=int)
+    parser.add_argument("--workers", default=None, type=int, help="processes for the initial scan (default: one per CPU)")
+    parser.add_argument("--debounce", default=DEFAULT_DEBOUNCE, type=float, help="seconds without file events before changed files are synced")
+    args = parser.parse_args()
+    notebookpath = Path(args.notebookpath).resolve()
+
+    host = '127.0.0.1'
+    main(notebookpath=notebookpath, host=host, port=args.port, use_polling=args.polling, workers=args.workers, debounce=args.debounce)
+
+
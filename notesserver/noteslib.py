@@ -4,8 +4,29 @@
 
 import re
 import os
+import sys
+import functools
+import mmap
+import threading
+import time
+import collections
+import itertools
+import bisect
+import json
+import hashlib
+import sqlite3
+import array
+import multiprocessing
+import concurrent.futures
 from pathlib import Path
 import datetime
+try:   # python >= 3.11
+    from re import _parser as sre_parse, _constants as sre_constants
+    from re._casefix import _EXTRA_CASES as _RE_EXTRA_CASES
+except ImportError:
+    import sre_parse
+    import sre_constants
+    _RE_EXTRA_CASES = {}
 
 
 ENTRY_ID_FORMAT = "%Y%m%d-%H%M%S"
@@ -15,6 +36,18 @@ ARCHIVE_FOLDERNAME = "_Archive"
 MARKDOWN_SUFFIX = ".md"
 TAG_NAMESPACE_SEPARATOR = "_"
 ENTRY_PREFIX = "### "
+LINK_CACHE_SIZE = 4096
+PARALLEL_PARSE_MIN_BYTES = 4 * 1024 * 1024   # below this, starting worker processes costs more than parsing in-process
+PARALLEL_PARSE_CHUNK_BYTES = 4 * 1024 * 1024
+RACY_MTIME_NS = 2 * 1000 * 1000 * 1000   # directory listings younger than this (by mtime) are not trusted, see PathIndex
+DIRECTORY_SNAPSHOTS_MAX = 64   # directories whose listings are kept in memory, see DirectorySnapshots
+SEARCH_INDEX_VERSION = "2"
+SEARCH_INDEX_FILENAME = ".search_v" + SEARCH_INDEX_VERSION + ".sqlite"
+PARSE_SNAPSHOT_VERSION = "1"
+PARSE_SNAPSHOT_FILENAME = ".parsecache_v" + PARSE_SNAPSHOT_VERSION + ".sqlite"
+PARSE_SNAPSHOT_PRUNE_INTERVAL = 600   # seconds between removals of parse snapshot rows of deleted files, see ParseSnapshot.store
+SQLITE_BUSY_TIMEOUT = 5   # seconds to wait for a locked sidecar database (the timeout of sqlite3.connect is SQLite's busy timeout)
+SQLITE_MAX_PARAMETERS = 500   # host parameters per statement, below SQLITE_MAX_VARIABLE_NUMBER of older SQLite versions (999)
 TAG_PREFIX = r"x"
 TAG_REGEX = re.compile(r'((?:^|\s+))' + TAG_PREFIX + r'(\w+)\b')
 entryregexes = [[re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) ?(.*)'), "%Y-%m-%d %H:%M:%S"],
@@ -23,9 +56,22 @@ entryregexes = [[re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) ?(.*)'), "%Y
                 [re.compile(r'(\d{8}) ?(.*)'), "%Y%m%d"],
                 [re.compile(r'(\d{6}) ?(.*)'), "%y%m%d"]
                ]
+# single-pass equivalent of entryregexes: the alternatives and optional groups are ordered so that
+# every headline matches the same date prefix as the first matching entry in entryregexes
+HEADLINE_REGEX = re.compile(r'(?:(\d{4})-(\d{2})-(\d{2})(?: (\d{2}):(\d{2})(?::(\d{2}))?)?|(\d{4})(\d{2})(\d{2})|(\d{2})(\d{2})(\d{2})) ?(.*)')
+# finds the lines starting with ENTRY_PREFIX (except on the first line) in a bytes buffer, capturing %Y-%m-%d[ %H:%M[:%S]] dates
+_HEADLINE_BYTES_REGEX = re.compile(b'\n' + re.escape(ENTRY_PREFIX.encode("utf-8")) + rb'(?:[ \t]*(\d{4}-\d{2}-\d{2}(?: \d{2}:\d{2}(?::\d{2})?)?))?')
+extra_entryregexes = []   # [regex, strptime format] pairs, see registerEntryDateFormat
+_parse_pool = None   # (key, ProcessPoolExecutor) shared by parseFiles calls, see _parsePool
+_parse_pool_lock = threading.Lock()
+# case folding for the trigram index, see _foldcase: U+0130 lowercases to two characters, and re.IGNORECASE
+# additionally matches some characters with different lowercase forms (e.g. "s" and U+017F)
+_FOLD_BEFORE_LOWER = {0x130: "i"}
+_FOLD_AFTER_LOWER = {c: chr(min((c,) + tuple(extras))) for c, extras in _RE_EXTRA_CASES.items()}
 anchor_regex = re.compile(r'[^\w-]')
 JOURNAL_FILE_REGEX = re.compile(r'(\d\d\d\d)-Q([1-4])\.md$')
 IMAGE_OR_LINK_REGEX = re.compile(r'(!?)\[([^\]]*)\]\(([^\)]*)\)')
+_UNSET = object()
 
 
 def _stripcontent(thecontent):
@@ -40,6 +86,171 @@ def _get_anchor(headline_without_entry_prefix):
     return anchor_regex.sub("", headline_without_entry_prefix.replace(" ", "-")).lower()
 
 
+def registerEntryDateFormat(regex, date_format):
+    """Registers an additional entry headline format.
+
+    regex must match at the start of the headline (after ENTRY_PREFIX) and provide two groups: the
+    date string, which is decoded with datetime.strptime(date_format), and the rest of the headline.
+    Registered formats are tried before the built-in ones.
+    """
+    extra_entryregexes.append([re.compile(regex), date_format])
+
+
+def _parseConfig():
+    # what, besides untaggedtag and date_format, changes the parse results: the registered headline formats
+    return [[entryregex.pattern, date_format] for entryregex, date_format in extra_entryregexes]
+
+
+def parseHeadline(headline):
+    """Returns (date, rest of headline) for a headline without ENTRY_PREFIX, or None if it does not start with a date."""
+    headline = headline.lstrip()
+    for entryregex, date_format in extra_entryregexes:
+        thematch = entryregex.match(headline)
+        if thematch is not None:
+            return datetime.datetime.strptime(thematch.group(1), date_format), thematch.group(2)
+
+    thematch = HEADLINE_REGEX.match(headline)
+    if thematch is None:
+        return None
+
+    g = thematch.groups()
+    if g[0] is not None:   # %Y-%m-%d [%H:%M[:%S]]
+        thedate = datetime.datetime(int(g[0]), int(g[1]), int(g[2]),
+                                    0 if g[3] is None else int(g[3]),
+                                    0 if g[4] is None else int(g[4]),
+                                    0 if g[5] is None else int(g[5]))
+    elif g[6] is not None:   # %Y%m%d
+        thedate = datetime.datetime(int(g[6]), int(g[7]), int(g[8]))
+    else:   # %y%m%d, same century rule as strptime
+        year = int(g[9])
+        thedate = datetime.datetime(year + (2000 if year < 69 else 1900), int(g[10]), int(g[11]))
+
+    return thedate, g[12]
+
+
+class Entry:
+    """A parsed journal entry.
+
+    Only date, content, tags and pos are stored; rel_path, location and anchorlocation are derived
+    on access (or overridden by assignment). Entries can still be used like the dicts parseEntries
+    used to return, e.g. entry["tags"] or entry.get("date"), including other keys set by the caller
+    (e.g. entry["origin"] in Attic/compile_handout.py), which are kept in a dict of their own.
+    """
+
+    __slots__ = ("date", "content", "tags", "pos", "_path", "_notebookpath", "_headline", "_rel_path", "_location", "_anchorlocation", "_extra")
+    KEYS = ("date", "content", "tags", "pos", "rel_path", "location", "anchorlocation")
+
+    def __init__(self, date, content, tags, pos, path, notebookpath, headline):
+        self.date = date
+        self.content = content
+        self.tags = tags
+        self.pos = pos
+        self._path = path
+        self._notebookpath = notebookpath
+        self._headline = headline   # headline without ENTRY_PREFIX, before date reformatting (used for the anchor)
+        self._rel_path = _UNSET
+        self._location = _UNSET
+        self._anchorlocation = _UNSET
+        self._extra = None   # keys other than KEYS, created on first assignment
+
+    @property
+    def rel_path(self):
+        if self._rel_path is _UNSET:
+            return self._path.relative_to(self._notebookpath)
+        return self._rel_path
+
+    @rel_path.setter
+    def rel_path(self, value):
+        self._rel_path = value
+
+    @property
+    def location(self):
+        if self._location is _UNSET:
+            return "/" + self.rel_path.as_posix() + "#L" + str(self.pos)
+        return self._location
+
+    @location.setter
+    def location(self, value):
+        self._location = value
+
+    @property
+    def anchorlocation(self):
+        if self._anchorlocation is _UNSET:
+            return "/" + self.rel_path.as_posix() + "#" + _get_anchor(self._headline)
+        return self._anchorlocation
+
+    @anchorlocation.setter
+    def anchorlocation(self, value):
+        self._anchorlocation = value
+
+    def copy(self):
+        """Returns a copy sharing the content with this entry, but with its own tags list."""
+        e = Entry(date=self.date, content=self.content, tags=list(self.tags), pos=self.pos,
+                  path=self._path, notebookpath=self._notebookpath, headline=self._headline)
+        e._rel_path = self._rel_path
+        e._location = self._location
+        e._anchorlocation = self._anchorlocation
+        e._extra = None if self._extra is None else dict(self._extra)
+        return e
+
+    def __getitem__(self, key):
+        if key in Entry.KEYS:
+            return getattr(self, key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in Entry.KEYS:
+            setattr(self, key, value)
+            return
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def __contains__(self, key):
+        return key in Entry.KEYS or (self._extra is not None and key in self._extra)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(Entry.KEYS) + (0 if self._extra is None else len(self._extra))
+
+    def get(self, key, default=None):
+        if key in Entry.KEYS:
+            return getattr(self, key)
+        if self._extra is None:
+            return default
+        return self._extra.get(key, default)
+
+    def keys(self):
+        if self._extra is None:
+            return Entry.KEYS
+        return Entry.KEYS + tuple(self._extra)
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def __repr__(self):
+        return "Entry(" + repr(self.date) + ", " + repr(self.location) + ")"
+
+
+@functools.lru_cache(maxsize=LINK_CACHE_SIZE)
+def _resolveLink(thelink, notebookPath, originPath, destinationPathAbsolute=None):
+    # purely lexical equivalent of (base / thelink).resolve() (symlinks are not followed), no filesystem access
+    if thelink.startswith("/"):
+        rellink = Path(os.path.normpath(os.path.join(notebookPath, thelink[1:])))
+    else:   # "./x", "../x" and bare "x" are all relative to originPath
+        rellink = Path(os.path.normpath(os.path.join(originPath, thelink)))
+
+    if destinationPathAbsolute is None:
+        return "/" + rellink.relative_to(notebookPath).as_posix()
+
+    # python >= 3.12: rellink.relative_to(destinationPath, walk_up=True).as_posix()
+    return Path(os.path.relpath(path=rellink, start=destinationPathAbsolute)).as_posix()
+
+
 def __replaceLinkMatch(l, notebookPath, originPath, destinationPathAbsolute=None):
     linkPrefix = l.group(1)
     linkText = l.group(2)
@@ -51,19 +262,7 @@ def __replaceLinkMatch(l, notebookPath, originPath, destinationPathAbsolute=None
     if "://" in thelink:
         return linkPrefix + "[" + linkText + "](" + thelink + ")"
 
-    if thelink.startswith("/"):
-        rellink = (notebookPath / thelink[1:]).resolve()
-    elif not thelink.startswith("./") and not thelink.startswith("../"):
-        thelink = "./" + thelink
-        rellink = (originPath / thelink).resolve()
-    else:
-        rellink = (originPath / thelink).resolve()
-
-    if destinationPathAbsolute is None:
-        thelink = "/" + rellink.relative_to(notebookPath).as_posix()
-    else:
-        # python >= 3.12: rellink.relative_to(destinationPath, walk_up=True).as_posix()
-        thelink = Path(os.path.relpath(path=rellink.absolute(), start=destinationPathAbsolute)).as_posix()
+    thelink = _resolveLink(thelink, notebookPath, originPath, destinationPathAbsolute)
 
     return linkPrefix + "[" + linkText + "](" + thelink + ")"
 
@@ -79,6 +278,8 @@ def createQuarterFile(today, thepath, fileprefix, filesuffix="", filecontent="\n
 
 
 def updateLinks(content, notebookPath, originPath, destinationPathAbsolute=None):
+    if "](" not in content:
+        return content
     return IMAGE_OR_LINK_REGEX.sub(lambda x: __replaceLinkMatch(l=x, notebookPath=notebookPath, originPath=originPath, destinationPathAbsolute=destinationPathAbsolute), content)
 
 
@@ -138,6 +339,13 @@ def taggifyLink(lt, notebookpath):
     return lt.replace("/", TAG_NAMESPACE_SEPARATOR)
 
 
+def linkTag(thelink, notebookpath, originPath):
+    """The tag findTags derives from a link (not an image) to thelink, in a file in originPath (see updateLinks)."""
+    if "://" not in thelink:
+        thelink = _resolveLink(thelink, notebookpath, originPath)
+    return taggifyLink(lt=thelink, notebookpath=notebookpath)
+
+
 def findTags(line, tag_dict, notebookpath):
     for l in TAG_REGEX.findall(line):
         tag_dict[l[1].lower()] = True
@@ -149,90 +357,1570 @@ def findTags(line, tag_dict, notebookpath):
             tag_dict[lt] = True
 
 
-def parseEntries(thepath, notebookpath, untaggedtag=UNTAGGED_TAG, date_format=None):
-    entries = []
-    prefix = []
-    prefixTags = {}
-    originPath = thepath.parent
+def iterEntries(thepath, notebookpath, untaggedtag=UNTAGGED_TAG, date_format=None, stop_date=None, headers_only=False, prefix=None, prefixTags=None):
+    """Yields the entries of a journal file one at a time.
 
+    If stop_date is given, iteration ends at the first headline dated after stop_date (only
+    meaningful for files sorted in ascending order). With headers_only, the content lines are
+    not kept (entry.content is None). Lines before the first entry are appended to prefix and
+    their tags added to prefixTags, if those are given.
+    """
     with open(thepath, "r", encoding="utf-8") as f:
-        lasttime = None
-        lastcontent = []
-        lastpos = 0
-        lastanchor = None
-        lasttags = {}
-        pos = -1
-        for line in f:
-            line = line.rstrip()
-            line = updateLinks(line, notebookPath=notebookpath, originPath=originPath)
-            pos = pos + 1
-
-            thematch = None
-            thedateformat = None
-            isEntryHeadline = False
-            if line.startswith(ENTRY_PREFIX):
-                for entryregex in entryregexes:
-                    thematch = entryregex[0].match(line[len(ENTRY_PREFIX):].lstrip())
-                    if thematch is not None:
-                        thedateformat = entryregex[1]
-                        isEntryHeadline = True
-                        break
+        yield from _iterEntries(lines=f, thepath=thepath, notebookpath=notebookpath, untaggedtag=untaggedtag, date_format=date_format,
+                                stop_date=stop_date, headers_only=headers_only, prefix=prefix, prefixTags=prefixTags)
 
-            if isEntryHeadline and thematch is not None and thedateformat is not None:
 
-                if len(lastcontent) != 0:
+def _iterEntries(lines, thepath, notebookpath, untaggedtag, date_format, stop_date=None, headers_only=False, prefix=None, prefixTags=None, firstpos=0):
+    originPath = thepath.parent
+
+    lasttime = None
+    lastcontent = []
+    lastpos = 0
+    lastheadline = None
+    lasttags = {}
+    pos = firstpos - 1
+    for line in lines:
+        line = line.rstrip()
+        line = updateLinks(line, notebookPath=notebookpath, originPath=originPath)
+        pos = pos + 1
+
+        parsedHeadline = None
+        if line.startswith(ENTRY_PREFIX):
+            parsedHeadline = parseHeadline(line[len(ENTRY_PREFIX):])
+
+        if parsedHeadline is not None:
+
+            if lasttime is not None:
+                if not headers_only:
                     _stripcontent(thecontent=lastcontent)
-                    if untaggedtag is not None and len(lasttags) == 0:
-                        lasttags = {untaggedtag: True}
-
-                    rel_path = thepath.relative_to(notebookpath)
-                    entries.append({"date": lasttime,
-                                    "content": lastcontent,
-                                    "tags": list(lasttags.keys()),
-                                    "pos": lastpos,
-                                    "rel_path": rel_path,
-                                    "location": ("/" + rel_path.as_posix() + "#L" + str(lastpos)),
-                                    "anchorlocation": ("/" + rel_path.as_posix() + "#" + lastanchor)
-                                  })
-
-                #thedate = datetime.datetime.min if thedateformat is None else datetime.datetime.strptime(thematch.group(1), thedateformat)
-                thedate = datetime.datetime.strptime(thematch.group(1), thedateformat)
-
-                lastanchor = _get_anchor(line[len(ENTRY_PREFIX):])
-                if date_format is not None:
-                    line = ENTRY_PREFIX + thedate.strftime(date_format) + " " + thematch.group(2).lstrip()
-
-                lasttime = thedate
-                lastcontent = [line]
-                lasttags = {}
-                findTags(line=line, tag_dict=lasttags, notebookpath=notebookpath)
-                lastpos = pos + 1
-            else:
+                if untaggedtag is not None and len(lasttags) == 0:
+                    lasttags = {untaggedtag: True}
+
+                yield Entry(date=lasttime, content=None if headers_only else lastcontent, tags=list(lasttags.keys()), pos=lastpos,
+                            path=thepath, notebookpath=notebookpath, headline=lastheadline)
+
+            thedate, headlinerest = parsedHeadline
+            if stop_date is not None and thedate > stop_date:
+                return
 
-                if lasttime is None:
+            lastheadline = line[len(ENTRY_PREFIX):]
+            if date_format is not None:
+                line = ENTRY_PREFIX + thedate.strftime(date_format) + " " + headlinerest.lstrip()
+
+            lasttime = thedate
+            lastcontent = [] if headers_only else [line]
+            lasttags = {}
+            findTags(line=line, tag_dict=lasttags, notebookpath=notebookpath)
+            lastpos = pos + 1
+        else:
+
+            if lasttime is None:
+                if prefix is not None:
                     prefix.append(line)
+                if prefixTags is not None:
                     findTags(line=line, tag_dict=prefixTags, notebookpath=notebookpath)
-                else:
+            else:
+                if not headers_only:
                     lastcontent.append(line)
-                    findTags(line=line, tag_dict=lasttags, notebookpath=notebookpath)
+                findTags(line=line, tag_dict=lasttags, notebookpath=notebookpath)
 
-        if len(lastcontent) != 0:
+    if lasttime is not None:
+        if not headers_only:
             _stripcontent(thecontent=lastcontent)
-            if untaggedtag is not None and len(lasttags) == 0:
-                lasttags = {untaggedtag: True}
-
-            rel_path = thepath.relative_to(notebookpath)
-            entries.append({"date": lasttime,
-                            "content": lastcontent,
-                            "tags": list(lasttags.keys()),
-                            "pos": lastpos,
-                            "rel_path": rel_path,
-                            "location": ("/" + rel_path.as_posix() + "#L" + str(lastpos)),
-                            "anchorlocation": ("/" + rel_path.as_posix() + "#" + lastanchor)
-                          })
+        if untaggedtag is not None and len(lasttags) == 0:
+            lasttags = {untaggedtag: True}
+
+        yield Entry(date=lasttime, content=None if headers_only else lastcontent, tags=list(lasttags.keys()), pos=lastpos,
+                    path=thepath, notebookpath=notebookpath, headline=lastheadline)
+
+
+def _isoDateBounds(start_date, stop_date):
+    # bounds for comparing "%Y-%m-%d[ %H:%M[:%S]]" headline dates as bytes: the start bound is rounded up to
+    # whole seconds and trailing zero components are dropped, so that e.g. b"2024-01-02" >= b"2024-01-02"
+    start_key = None
+    if start_date is not None:
+        if start_date.microsecond != 0:
+            start_date = start_date.replace(microsecond=0) + datetime.timedelta(seconds=1)
+        start_key = "%04d-%02d-%02d" % (start_date.year, start_date.month, start_date.day)
+        if start_date.second != 0:
+            start_key += " %02d:%02d:%02d" % (start_date.hour, start_date.minute, start_date.second)
+        elif start_date.hour != 0 or start_date.minute != 0:
+            start_key += " %02d:%02d" % (start_date.hour, start_date.minute)
+        start_key = start_key.encode("ascii")
+
+    stop_key = None
+    if stop_date is not None:
+        stop_key = ("%04d-%02d-%02d %02d:%02d:%02d" % (stop_date.year, stop_date.month, stop_date.day, stop_date.hour, stop_date.minute, stop_date.second)).encode("ascii")
+
+    return start_key, stop_key
+
+
+def scanEntries(thepath, notebookpath, start_date=None, stop_date=None, untaggedtag=UNTAGGED_TAG, date_format=None):
+    """Yields the entries of a journal file dated within [start_date, stop_date].
+
+    Same entries as filtering iterEntries by date, but the file is memory-mapped and only the
+    headlines are looked at to find the dates; the content of an entry is decoded and parsed only
+    if the entry is inside the window. Expects "\n" or "\r\n" line endings.
+    """
+    with open(thepath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            start_key, stop_key = _isoDateBounds(start_date=start_date, stop_date=stop_date)
+            decode_all = len(extra_entryregexes) != 0   # registered formats take precedence, see parseHeadline
+
+            # (offset, is inside window) for every line that is an entry headline
+            headlines = []
+            for offset, isodate in _headlineOffsets(mm):
+                if isodate is None or decode_all:
+                    parsedHeadline = _headlineAt(mm, offset)
+                    if parsedHeadline is not None:
+                        headlines.append((offset, (start_date is None or parsedHeadline[0] >= start_date) and (stop_date is None or parsedHeadline[0] <= stop_date)))
+                else:
+                    headlines.append((offset, (start_key is None or isodate >= start_key) and (stop_key is None or isodate <= stop_key)))
+
+            lineno = 0
+            lineno_offset = 0
+            for i, (offset, in_window) in enumerate(headlines):
+                if not in_window:
+                    continue
+
+                lineno += mm[lineno_offset:offset].count(b"\n")
+                lineno_offset = offset
+                end = headlines[i + 1][0] if i + 1 < len(headlines) else size
+                text = mm[offset:end].decode("utf-8").replace("\r\n", "\n")
+                lines = text.split("\n")
+                if text.endswith("\n"):
+                    lines.pop()
+
+                yield from _iterEntries(lines=lines, thepath=thepath, notebookpath=notebookpath, untaggedtag=untaggedtag,
+                                        date_format=date_format, firstpos=lineno)
+
+
+def _headlineOffsets(mm):
+    # (offset, ISO date as bytes or None) of every line starting with ENTRY_PREFIX in the memory-mapped file
+    entry_prefix = ENTRY_PREFIX.encode("utf-8")
+    if mm[:len(entry_prefix)] == entry_prefix:
+        yield 0, None
+    for m in _HEADLINE_BYTES_REGEX.finditer(mm):
+        yield m.start() + 1, m.group(1)
+
+
+def _headlineAt(mm, offset):
+    # parseHeadline of the line starting at offset
+    lineend = mm.find(b"\n", offset)
+    if lineend == -1:
+        lineend = len(mm)
+    return parseHeadline(mm[offset + len(ENTRY_PREFIX.encode("utf-8")):lineend].decode("utf-8").rstrip())
+
+
+def entryDateRange(thepath):
+    """Returns (earliest, latest) date of the entries of a journal file, or None if it has no entries.
+
+    Like scanEntries, only the headlines of the memory-mapped file are looked at.
+    """
+    with open(thepath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            decode_all = len(extra_entryregexes) != 0   # registered formats take precedence, see parseHeadline
+            earliest = None
+            latest = None
+            for offset, isodate in _headlineOffsets(mm):
+                if isodate is None or decode_all:
+                    parsedHeadline = _headlineAt(mm, offset)
+                    if parsedHeadline is None:
+                        continue
+                    thedate = parsedHeadline[0]
+                else:
+                    thedate = datetime.datetime.fromisoformat(isodate.decode("ascii"))
+
+                if earliest is None or thedate < earliest:
+                    earliest = thedate
+                if latest is None or thedate > latest:
+                    latest = thedate
+
+    return None if earliest is None else (earliest, latest)
+
+
+def parseEntries(thepath, notebookpath, untaggedtag=UNTAGGED_TAG, date_format=None):
+    prefix = []
+    prefixTags = {}
+    entries = list(iterEntries(thepath=thepath, notebookpath=notebookpath, untaggedtag=untaggedtag, date_format=date_format,
+                               prefix=prefix, prefixTags=prefixTags))
 
     if untaggedtag is not None and len(prefixTags) == 0:
         prefixTags = {untaggedtag: True}
 
     return {"prefix": prefix, "prefixTags": prefixTags, "entries": entries}
 
+
+def parseFiles(paths, notebookpath, untaggedtag=UNTAGGED_TAG, date_format=None, headers_only=False, workers=None, chunk_bytes=PARALLEL_PARSE_CHUNK_BYTES,
+               failed=None):
+    """Parses many journal files, using worker processes if worth it.
+
+    Yields (path, entries, prefixTags) per file, in no particular order; files that cannot be read
+    are reported, skipped and appended to failed, if given. workers is the number of processes
+    (None: one per CPU, 1: parse in this process). Files are grouped into chunks of about
+    chunk_bytes, largest first, so that the workers get similar amounts of work. The worker
+    processes are kept for later calls, see _parsePool.
+    """
+    sized = []
+    for thepath in paths:
+        try:
+            sized.append((os.stat(thepath).st_size, thepath))
+        except OSError as e:
+            print(f"Failed to parse {thepath}: {e}")
+            if failed is not None:
+                failed.append(thepath)
+    sized.sort(key=lambda s: s[0], reverse=True)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    total = sum(size for size, _ in sized)
+    if workers <= 1 or len(sized) < 2 or total < PARALLEL_PARSE_MIN_BYTES:
+        for _, thepath in sized:
+            yield from _unpackChunk(_parseChunk(paths=[thepath], notebookpath=notebookpath, untaggedtag=untaggedtag, date_format=date_format,
+                                                headers_only=headers_only), notebookpath=notebookpath, failed=failed)
+        return
+
+    # at least a few chunks per worker, so that one slow chunk does not keep the others waiting
+    chunk_bytes = max(1, min(chunk_bytes, total // (workers * 4)))
+    chunks = []
+    chunk_size = 0
+    for size, thepath in sized:
+        if len(chunks) == 0 or chunk_size >= chunk_bytes:
+            chunks.append([])
+            chunk_size = 0
+        chunks[-1].append(thepath)
+        chunk_size += size
+
+    pending = set(range(len(chunks)))
+    executor = None
+    try:
+        executor = _parsePool(workers=workers)
+        futures = {executor.submit(_parseChunk, paths=chunk, notebookpath=notebookpath, untaggedtag=untaggedtag, date_format=date_format,
+                                   headers_only=headers_only): i for i, chunk in enumerate(chunks)}
+        for future in concurrent.futures.as_completed(futures):
+            parsed = future.result()
+            pending.discard(futures[future])
+            yield from _unpackChunk(parsed, notebookpath=notebookpath, failed=failed)
+    except (OSError, RuntimeError, concurrent.futures.process.BrokenProcessPool) as e:   # RuntimeError: replaced by another call meanwhile
+        print(f"Parallel parsing failed, parsing the remaining files in-process: {e}")
+        if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+            _discardParsePool(executor=executor)
+        for i in sorted(pending):
+            yield from _unpackChunk(_parseChunk(paths=chunks[i], notebookpath=notebookpath, untaggedtag=untaggedtag, date_format=date_format,
+                                                headers_only=headers_only), notebookpath=notebookpath, failed=failed)
+
+
+@functools.lru_cache(maxsize=None)
+def _parseContext():
+    # worker processes are started with forkserver (spawn where that is not available) rather than forked, as the callers
+    # run threads whose locks a forked child could inherit in a locked state
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    mp_context = multiprocessing.get_context("forkserver")
+    mp_context.set_forkserver_preload([__name__])   # the (single-threaded) fork server imports this module once for all workers
+    return mp_context
+
+
+def _parsePool(workers):
+    # the worker processes of parseFiles: started (on demand) by the first call and kept for the following ones, so that
+    # only the first pays for starting them; replaced if workers or the registered entry date formats (passed on to the
+    # workers by _initParseWorker) changed
+    global _parse_pool
+    parse_config = _parseConfig()
+    key = (workers, json.dumps(parse_config))
+    with _parse_pool_lock:
+        if _parse_pool is not None and _parse_pool[0] == key:
+            return _parse_pool[1]
+        if _parse_pool is not None:
+            _parse_pool[1].shutdown(wait=False)
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=_parseContext(),
+                                                          initializer=_initParseWorker, initargs=(parse_config,))
+        _parse_pool = (key, executor)
+        return executor
+
+
+def _discardParsePool(executor):
+    # drops a broken pool, so that the next parseFiles call starts a new one
+    global _parse_pool
+    if executor is None:
+        return
+    with _parse_pool_lock:
+        if _parse_pool is not None and _parse_pool[1] is executor:
+            _parse_pool = None
+    executor.shutdown(wait=False)
+
+
+def _initParseWorker(parse_config):
+    # runs in new worker processes: the headline formats registered in the parent, see _parseConfig
+    for regex, date_format in parse_config:
+        registerEntryDateFormat(regex=regex, date_format=date_format)
+
+
+def _parseChunk(paths, notebookpath, untaggedtag, date_format, headers_only):
+    # runs in the worker processes: entries are returned as plain tuples, which pickle much smaller than Entry objects;
+    # files that cannot be parsed are returned with entries None
+    result = []
+    for thepath in paths:
+        prefixTags = {}
+        try:
+            entries = [(e.date, None if headers_only else tuple(e.content), e.tags, e.pos, e._headline)
+                       for e in iterEntries(thepath=thepath, notebookpath=notebookpath, untaggedtag=untaggedtag, date_format=date_format,
+                                            headers_only=headers_only, prefixTags=prefixTags)]
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            print(f"Failed to parse {thepath}: {e}")
+            result.append((thepath, None, None))
+            continue
+        result.append((thepath, entries, list(prefixTags.keys())))
+    return result
+
+
+def _unpackChunk(parsed, notebookpath, failed=None):
+    for thepath, entries, prefixTags in parsed:
+        if entries is None:
+            if failed is not None:
+                failed.append(thepath)
+            continue
+        yield thepath, [Entry(date=d, content=content, tags=tags, pos=pos, path=thepath, notebookpath=notebookpath, headline=headline)
+                        for d, content, tags, pos, headline in entries], prefixTags
+
+
+class ParseSnapshot:
+    """Persistent copy of parsed journal files in a SQLite sidecar file under the notebook.
+
+    Rows are validated by the file's (st_mtime_ns, st_size) signature when loaded. The schema
+    version is part of the file name; a snapshot that is corrupt is deleted and recreated. If the
+    snapshot is only unavailable, e.g. locked by another process for longer than SQLITE_BUSY_TIMEOUT,
+    callers parse the file instead and the snapshot is left alone. Each thread keeps one connection
+    (see close); loadMany and storeMany read and write many files in one query or transaction.
+    """
+
+    def __init__(self, notebookpath):
+        self.notebookpath = notebookpath
+        self.db_path = notebookpath / PARSE_SNAPSHOT_FILENAME
+        self._last_prune = 0.0
+        self._local = threading.local()
+        self._generation = 0   # incremented when the file is recreated, so that threads reconnect to the new file
+        self._init_db()
+
+    def _connection(self):
+        # persistent connection of the current thread
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.generation != self._generation:
+            conn.close()
+            conn = None
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=SQLITE_BUSY_TIMEOUT)
+            self._local.conn = conn
+            self._local.generation = self._generation
+        return conn
+
+    def close(self):
+        """Closes the current thread's connection; the next call opens a new one."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _init_db(self):
+        try:
+            self._create_tables()
+            check = self._connection().execute("PRAGMA quick_check").fetchone()[0]
+            if check != "ok":
+                self._reset(reason="quick_check: " + check)
+        except sqlite3.DatabaseError as e:
+            self._failed(e)
+
+    def _create_tables(self):
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS parsed_files (
+                    path TEXT,
+                    options TEXT,
+                    mtime_ns INTEGER,
+                    size INTEGER,
+                    entries TEXT,
+                    PRIMARY KEY (path, options)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS file_ranges (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER,
+                    size INTEGER,
+                    earliest TEXT,
+                    latest TEXT
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _failed(self, e):
+        # OperationalError: locked, busy or out of disk space, which passes; anything else means the file is corrupt
+        if isinstance(e, sqlite3.OperationalError):
+            print(f"Parse snapshot {self.db_path.as_posix()} unavailable: {e}")
+            return
+        self._reset(reason=e)
+
+    def _reset(self, reason):
+        print(f"Rebuilding parse snapshot {self.db_path.as_posix()}: {reason}")
+        try:
+            self.close()
+            self._generation += 1
+            self.db_path.unlink(missing_ok=True)
+            self._create_tables()
+        except (OSError, sqlite3.DatabaseError) as e:
+            print(f"Failed to rebuild parse snapshot: {e}")
+
+    def _options(self, untaggedtag, date_format):
+        return json.dumps([untaggedtag, date_format, _parseConfig()])
+
+    def load(self, thepath, notebookpath, signature, untaggedtag=UNTAGGED_TAG, date_format=None):
+        """Returns the stored entries of thepath, or None if there are none for this signature."""
+        return self.loadMany(files=[(thepath, signature)], notebookpath=notebookpath, untaggedtag=untaggedtag, date_format=date_format).get(thepath)
+
+    def loadMany(self, files, notebookpath, untaggedtag=UNTAGGED_TAG, date_format=None):
+        """Returns a dict path -> stored entries for those of files, a list of (path, signature), stored with that signature."""
+        options = self._options(untaggedtag=untaggedtag, date_format=date_format)
+        wanted = {thepath.relative_to(self.notebookpath).as_posix(): (thepath, signature) for thepath, signature in files}
+        keys = list(wanted)
+        rows = []
+        try:
+            conn = self._connection()
+            for i in range(0, len(keys), SQLITE_MAX_PARAMETERS):
+                chunk = keys[i:i + SQLITE_MAX_PARAMETERS]
+                rows.extend(conn.execute("SELECT path, mtime_ns, size, entries FROM parsed_files WHERE options = ? AND path IN (" + ", ".join("?" * len(chunk)) + ")",
+                                         [options] + chunk).fetchall())
+        except sqlite3.DatabaseError as e:
+            self._failed(e)
+            return {}
+
+        loaded = {}
+        for path_key, mtime_ns, size, serialized in rows:
+            thepath, signature = wanted[path_key]
+            if (mtime_ns, size) != signature:
+                continue
+            try:
+                loaded[thepath] = [Entry(date=datetime.datetime.fromisoformat(d), content=tuple(content), tags=tags, pos=pos,
+                                         path=thepath, notebookpath=notebookpath, headline=headline)
+                                   for d, content, tags, pos, headline in json.loads(serialized)]
+            except (ValueError, TypeError) as e:
+                print(f"Ignoring invalid parse snapshot row for {path_key}: {e}")
+        return loaded
+
+    def store(self, thepath, signature, entries, untaggedtag=UNTAGGED_TAG, date_format=None):
+        """Stores the entries of thepath, see storeMany."""
+        self.storeMany(files=[(thepath, signature, entries)], untaggedtag=untaggedtag, date_format=date_format)
+
+    def storeMany(self, files, untaggedtag=UNTAGGED_TAG, date_format=None):
+        """Stores the entries of files, a list of (path, signature, entries), in one transaction; every
+        PARSE_SNAPSHOT_PRUNE_INTERVAL seconds, also drops the rows of deleted files (see prune)."""
+        if len(files) == 0:
+            return
+        options = self._options(untaggedtag=untaggedtag, date_format=date_format)
+        rows = [(thepath.relative_to(self.notebookpath).as_posix(), options, signature[0], signature[1],
+                 json.dumps([[e.date.isoformat(), e.content, e.tags, e.pos, e._headline] for e in entries]))
+                for thepath, signature, entries in files]
+        try:
+            with self._connection() as conn:
+                conn.executemany("INSERT OR REPLACE INTO parsed_files (path, options, mtime_ns, size, entries) VALUES (?, ?, ?, ?, ?)", rows)
+        except sqlite3.DatabaseError as e:
+            self._failed(e)
+            return
+
+        if time.monotonic() - self._last_prune > PARSE_SNAPSHOT_PRUNE_INTERVAL:
+            self._last_prune = time.monotonic()
+            self.prune()
+
+    def prune(self):
+        """Drops the rows of files that no longer exist, and those parsed with other registered headline formats."""
+        parse_config = _parseConfig()
+        try:
+            with self._connection() as conn:
+                stale = []
+                for path_key, options in conn.execute("SELECT path, options FROM parsed_files").fetchall():
+                    try:
+                        outdated = json.loads(options)[2] != parse_config
+                    except (ValueError, TypeError, IndexError):
+                        outdated = True
+                    if outdated or not (self.notebookpath / path_key).is_file():
+                        stale.append((path_key, options))
+                conn.executemany("DELETE FROM parsed_files WHERE path = ? AND options = ?", stale)
+        except sqlite3.DatabaseError as e:
+            self._failed(e)
+
+    def loadRanges(self):
+        """Returns the stored entry date ranges (see JournalManifest) as a dict path -> (signature, (earliest, latest) or None)."""
+        parse_config = json.dumps(_parseConfig())
+        try:
+            with self._connection() as conn:
+                row = conn.execute("SELECT value FROM settings WHERE key = 'ranges_parse_config'").fetchone()
+                if row is None or row[0] != parse_config:   # headline dates may be decoded differently now
+                    conn.execute("DELETE FROM file_ranges")
+                    conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('ranges_parse_config', ?)", (parse_config,))
+                rows = conn.execute("SELECT path, mtime_ns, size, earliest, latest FROM file_ranges").fetchall()
+        except sqlite3.DatabaseError as e:
+            self._failed(e)
+            return {}
+
+        ranges = {}
+        for path_key, mtime_ns, size, earliest, latest in rows:
+            try:
+                daterange = None if earliest is None else (datetime.datetime.fromisoformat(earliest), datetime.datetime.fromisoformat(latest))
+            except ValueError:
+                continue
+            ranges[self.notebookpath / path_key] = ((mtime_ns, size), daterange)
+        return ranges
+
+    def storeRanges(self, changed, removed):
+        """Stores the date ranges of changed, a list of (path, signature, (earliest, latest) or None), and drops those of the removed paths."""
+        try:
+            with self._connection() as conn:
+                conn.executemany("INSERT OR REPLACE INTO file_ranges (path, mtime_ns, size, earliest, latest) VALUES (?, ?, ?, ?, ?)",
+                                 [(thepath.relative_to(self.notebookpath).as_posix(), signature[0], signature[1],
+                                   None if daterange is None else daterange[0].isoformat(), None if daterange is None else daterange[1].isoformat())
+                                  for thepath, signature, daterange in changed])
+                conn.executemany("DELETE FROM file_ranges WHERE path = ?", [(thepath.relative_to(self.notebookpath).as_posix(),) for thepath in removed])
+        except sqlite3.DatabaseError as e:
+            self._failed(e)
+
+
+def _loadEntries(thepath, notebookpath, signature, untaggedtag, date_format, snapshot):
+    # entries of thepath for caching: from the snapshot if still valid, otherwise parsed (and stored in the snapshot)
+    entries = None
+    if snapshot is not None:
+        entries = snapshot.load(thepath=thepath, notebookpath=notebookpath, signature=signature, untaggedtag=untaggedtag, date_format=date_format)
+
+    if entries is None:
+        entries = []
+        for e in iterEntries(thepath=thepath, notebookpath=notebookpath, untaggedtag=untaggedtag, date_format=date_format):
+            e.content = tuple(e.content)   # shared by all copies handed out, see Entry.copy
+            entries.append(e)
+        if snapshot is not None:
+            snapshot.store(thepath=thepath, signature=signature, entries=entries, untaggedtag=untaggedtag, date_format=date_format)
+
+    return entries
+
+
+def _loadEntriesMany(files, notebookpath, untaggedtag, date_format, snapshot, workers, failed=None):
+    # like _loadEntries for a list of (path, signature), parsing the files missing in the snapshot with parseFiles; yields (path, signature, entries)
+    # and appends the paths of files that cannot be parsed to failed, if given
+    signatures = dict(files)
+    stored = {} if snapshot is None else snapshot.loadMany(files=files, notebookpath=notebookpath, untaggedtag=untaggedtag, date_format=date_format)
+    missing = []
+    for thepath, signature in files:
+        entries = stored.get(thepath)
+        if entries is None:
+            missing.append(thepath)
+        else:
+            yield thepath, signature, entries
+
+    parsed = [(thepath, signatures[thepath], entries)
+              for thepath, entries, _ in parseFiles(paths=missing, notebookpath=notebookpath, untaggedtag=untaggedtag, date_format=date_format, workers=workers,
+                                                    failed=failed)]
+    if snapshot is not None:
+        snapshot.storeMany(files=parsed, untaggedtag=untaggedtag, date_format=date_format)
+    yield from parsed
+
+
+class ParseCache:
+    """Process-wide LRU cache of parsed journal files.
+
+    Entries are cached per (path, untaggedtag, date_format) and reused as long as the file's
+    (st_mtime_ns, st_size) signature is unchanged. The approximate size of the cached entries is
+    kept below max_bytes by evicting the least recently used files. Callers get copies of the
+    cached entries (see Entry.copy), so modifying them does not affect the cache. With a
+    ParseSnapshot, files missing in memory are loaded from the snapshot instead of being parsed.
+    prefetch() loads many files at once, parsing them with `workers` processes (see parseFiles).
+    """
+
+    def __init__(self, max_bytes, snapshot=None, workers=1):
+        self.max_bytes = max_bytes
+        self.snapshot = snapshot   # optional ParseSnapshot, consulted before parsing a file
+        self.workers = workers
+        self._files = collections.OrderedDict()   # key -> (signature, entries, size)
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def entries(self, thepath, notebookpath, start_date=None, stop_date=None, untaggedtag=UNTAGGED_TAG, date_format=None):
+        """Returns copies of the entries of thepath dated within [start_date, stop_date]."""
+        st = os.stat(thepath)
+        signature = (st.st_mtime_ns, st.st_size)
+        key = (thepath, untaggedtag, date_format)
+
+        with self._lock:
+            cached = self._files.get(key)
+            if cached is not None and cached[0] == signature:
+                self._files.move_to_end(key)
+                self.hits += 1
+                entries = cached[1]
+            else:
+                self.misses += 1
+                entries = None
+
+        if entries is None:
+            if st.st_size > self.max_bytes:   # would not fit anyway
+                return list(scanEntries(thepath=thepath, notebookpath=notebookpath, start_date=start_date, stop_date=stop_date,
+                                        untaggedtag=untaggedtag, date_format=date_format))
+
+            entries = _loadEntries(thepath=thepath, notebookpath=notebookpath, signature=signature, untaggedtag=untaggedtag,
+                                   date_format=date_format, snapshot=self.snapshot)
+            self._put(key=key, signature=signature, entries=entries)
+
+        return [e.copy() for e in entries if (start_date is None or e.date >= start_date) and (stop_date is None or e.date <= stop_date)]
+
+    def prefetch(self, paths, notebookpath, untaggedtag=UNTAGGED_TAG, date_format=None):
+        """Loads those of paths into the cache that are missing or outdated (and not larger than max_bytes)."""
+        missing = []
+        with self._lock:
+            for thepath in paths:
+                st = os.stat(thepath)
+                signature = (st.st_mtime_ns, st.st_size)
+                cached = self._files.get((thepath, untaggedtag, date_format))
+                if (cached is None or cached[0] != signature) and st.st_size <= self.max_bytes:
+                    missing.append((thepath, signature))
+
+        if len(missing) < 2:   # nothing to gain over entries()
+            return
+        for thepath, signature, entries in _loadEntriesMany(files=missing, notebookpath=notebookpath, untaggedtag=untaggedtag,
+                                                            date_format=date_format, snapshot=self.snapshot, workers=self.workers):
+            self._put(key=(thepath, untaggedtag, date_format), signature=signature, entries=entries)
+
+    def _put(self, key, signature, entries):
+        size = _entriesSize(entries)
+        with self._lock:
+            previous = self._files.pop(key, None)
+            if previous is not None:
+                self.size -= previous[2]
+            if size > self.max_bytes:
+                return
+
+            self._files[key] = (signature, entries, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self._files.popitem(last=False)
+                self.size -= evicted[2]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._files.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._files), "size": self.size, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class RenderCache:
+    """Process-wide LRU cache of rendered HTML.
+
+    Every value is stored along with the tags it depends on, so that invalidateTags() drops exactly
+    the values that depend on one of the given tags. The approximate size of the cached values (as
+    given to put) is kept below max_bytes by evicting the least recently used ones.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._values = collections.OrderedDict()   # key -> (value, tags, size)
+        self._keys_by_tag = {}   # tag -> set of keys
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Returns the value cached for key, or None."""
+        with self._lock:
+            cached = self._values.get(key)
+            if cached is None:
+                self.misses += 1
+                return None
+            self._values.move_to_end(key)
+            self.hits += 1
+            return cached[0]
+
+    def put(self, key, value, tags, size):
+        with self._lock:
+            self._remove(key=key)
+            if size > self.max_bytes:
+                return
+
+            self._values[key] = (value, tuple(tags), size)
+            for t in tags:
+                self._keys_by_tag.setdefault(t, set()).add(key)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(key=next(iter(self._values)))
+                self.evictions += 1
+
+    def invalidateTags(self, tags):
+        """Drops the values depending on any of tags."""
+        with self._lock:
+            for t in tags:
+                for key in list(self._keys_by_tag.get(t, ())):
+                    self._remove(key=key)
+                    self.invalidations += 1
+
+    def _remove(self, key):
+        cached = self._values.pop(key, None)
+        if cached is None:
+            return
+        self.size -= cached[2]
+        for t in cached[1]:
+            keys = self._keys_by_tag.get(t)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self._keys_by_tag[t]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._keys_by_tag.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"values": len(self._values), "size": self.size, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": None if lookups == 0 else self.hits / lookups, "evictions": self.evictions, "invalidations": self.invalidations}
+
+
+def _entriesSize(entries):
+    # approximate memory held by parsed entries (the Entry objects, their content lines and tag lists)
+    size = 0
+    for e in entries:
+        size += sys.getsizeof(e) + sys.getsizeof(e.content) + sys.getsizeof(e.tags)
+        for line in e.content:
+            size += sys.getsizeof(line)
+    return size
+
+
+def _walkFiles(thepath, suffix, skip=None):
+    # yields (Path, os.stat_result) for all files below thepath ending with suffix, like thepath.glob("**/*" + suffix),
+    # except those below the directory skip
+    try:
+        with os.scandir(thepath) as it:
+            dir_entries = list(it)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+
+    for dir_entry in dir_entries:
+        try:
+            if dir_entry.is_dir():
+                if skip is None or Path(dir_entry.path) != skip:
+                    yield from _walkFiles(Path(dir_entry.path), suffix=suffix, skip=skip)
+            elif dir_entry.name.endswith(suffix):
+                yield Path(dir_entry.path), dir_entry.stat()
+        except FileNotFoundError:
+            continue
+
+
+def treeSignature(thepath, suffix=MARKDOWN_SUFFIX):
+    """Returns (digest, latest st_mtime_ns) of all files below thepath ending with suffix.
+
+    The digest covers the path, st_mtime_ns and st_size of every file, so it changes whenever one of
+    them is added, removed or modified; only the directories are read, no file contents.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    latest = 0
+    for thefile, st in sorted(_walkFiles(thepath, suffix=suffix)):
+        digest.update(f"{thefile}\0{st.st_mtime_ns}\0{st.st_size}\0".encode("utf-8", "surrogateescape"))
+        latest = max(latest, st.st_mtime_ns)
+    return digest.hexdigest(), latest
+
+
+class PathIndex:
+    """Case-insensitive lookup of files below notebookpath, shared across requests.
+
+    A directory is listed (os.scandir) on its first lookup and kept in memory. After revalidate(),
+    it is checked again with a single stat on its next lookup, and only listed again if its mtime
+    changed. Directories modified within RACY_MTIME_NS of being listed are always listed again,
+    as files created in the same mtime tick would not change the mtime. The approximate size of
+    the kept listings is kept below max_bytes by evicting the least recently used directories.
+    """
+
+    def __init__(self, notebookpath, max_bytes):
+        self.notebookpath = notebookpath
+        self.max_bytes = max_bytes
+        # directory -> (st_mtime_ns or None if missing, trusted, {file name: True}, {lowercased file name: file name}, generation, size),
+        # least recently used first
+        self._dirs = collections.OrderedDict()
+        self._generation = 0
+        self._listings = 0
+        self.size = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def revalidate(self):
+        """Makes the next lookup in every directory check whether it changed."""
+        with self._lock:
+            self._generation += 1
+
+    def _directory(self, directory):
+        cached = self._dirs.get(directory)
+        if cached is not None and cached[4] == self._generation:
+            self._dirs.move_to_end(directory)
+            return cached
+
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+
+        if cached is not None and cached[1] and cached[0] == mtime_ns:
+            cached = cached[:4] + (self._generation, cached[5])
+        else:
+            names = {}
+            lowercased = {}
+            if mtime_ns is not None:
+                try:
+                    with os.scandir(directory) as it:
+                        for dir_entry in it:
+                            try:
+                                if dir_entry.is_file():
+                                    names[dir_entry.name] = True
+                                    lowercased.setdefault(dir_entry.name.lower(), dir_entry.name)
+                            except OSError:
+                                continue
+                except OSError:
+                    pass
+                self._listings += 1
+            trusted = mtime_ns is None or time.time_ns() - mtime_ns > RACY_MTIME_NS
+            size = sys.getsizeof(directory) + sys.getsizeof(names) + sys.getsizeof(lowercased) + sum(sys.getsizeof(n) for n in names) + sum(sys.getsizeof(n) for n in lowercased)
+            cached = (mtime_ns, trusted, names, lowercased, self._generation, size)
+
+        previous = self._dirs.pop(directory, None)
+        if previous is not None:
+            self.size -= previous[5]
+        if cached[5] > self.max_bytes:   # used for this lookup only
+            return cached
+
+        self._dirs[directory] = cached
+        self.size += cached[5]
+        while self.size > self.max_bytes:
+            _, evicted = self._dirs.popitem(last=False)
+            self.size -= evicted[5]
+            self.evictions += 1
+        return cached
+
+    def find(self, rel_path):
+        """Returns the notebook-relative Path of the file rel_path, or of a file in the same directory
+        whose name only differs in case, or None if there is no such file."""
+        with self._lock:
+            _, _, names, lowercased, _, _ = self._directory(self.notebookpath / rel_path.parent)
+
+        if rel_path.name in names:
+            return rel_path
+        name = lowercased.get(rel_path.name.lower())
+        return None if name is None else rel_path.parent / name
+
+    def stats(self):
+        with self._lock:
+            return {"directories": len(self._dirs), "size": self.size, "max_bytes": self.max_bytes,
+                    "listings": self._listings, "evictions": self.evictions}
+
+
+class DirectorySnapshots:
+    """Listings of directories, cached by directory mtime.
+
+    A snapshot is a list of (name, is_dir, st_mtime, st_size) tuples, built with os.scandir. It is
+    reused as long as the directory's mtime is unchanged, i.e. no child was created, deleted or
+    renamed; files modified in place keep their old st_mtime and st_size in the snapshot. Like
+    PathIndex, listings younger than RACY_MTIME_NS are not reused.
+    """
+
+    def __init__(self, max_dirs=DIRECTORY_SNAPSHOTS_MAX):
+        self.max_dirs = max_dirs
+        self._snapshots = collections.OrderedDict()   # directory -> (st_mtime_ns, trusted, snapshot), least recently used first
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def snapshot(self, directory):
+        """Returns the snapshot of directory (raises OSError if it cannot be listed)."""
+        mtime_ns = os.stat(directory).st_mtime_ns
+        with self._lock:
+            cached = self._snapshots.get(directory)
+            if cached is not None and cached[1] and cached[0] == mtime_ns:
+                self._snapshots.move_to_end(directory)
+                self._hits += 1
+                return cached[2]
+            self._misses += 1
+
+        snapshot = []
+        with os.scandir(directory) as it:
+            for dir_entry in it:
+                try:
+                    is_dir = dir_entry.is_dir()
+                    st = dir_entry.stat()
+                    snapshot.append((dir_entry.name, is_dir, st.st_mtime, st.st_size))
+                except OSError:   # e.g. a dangling symlink
+                    snapshot.append((dir_entry.name, False, None, None))
+
+        with self._lock:
+            self._snapshots[directory] = (mtime_ns, time.time_ns() - mtime_ns > RACY_MTIME_NS, snapshot)
+            self._snapshots.move_to_end(directory)
+            while len(self._snapshots) > self.max_dirs:
+                self._snapshots.popitem(last=False)
+
+        return snapshot
+
+    def stats(self):
+        with self._lock:
+            requests = self._hits + self._misses
+            return {"directories": len(self._snapshots), "hits": self._hits, "misses": self._misses,
+                    "hit_rate": 0.0 if requests == 0 else self._hits / requests}
+
+
+class JournalManifest:
+    """Date range of the entries of every journal file below journalpath.
+
+    Lets callers skip files without entries in a date window, whatever the files are called.
+    refresh() re-reads only the files whose (st_mtime_ns, st_size) signature changed; with a
+    ParseSnapshot, the ranges are persisted so that a restart does not need to re-read all files.
+    """
+
+    def __init__(self, notebookpath, journalpath, snapshot=None):
+        self.notebookpath = notebookpath
+        self.journalpath = journalpath
+        self.snapshot = snapshot
+        self._files = None   # path -> (signature, (earliest, latest) or None), loaded on the first refresh
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Picks up added, modified and removed journal files."""
+        with self._lock:
+            if self._files is None:
+                self._files = {} if self.snapshot is None else self.snapshot.loadRanges()
+
+            seen = set()
+            changed = []
+            for journal_file, st in _walkFiles(self.journalpath, suffix=MARKDOWN_SUFFIX):
+                seen.add(journal_file)
+                signature = (st.st_mtime_ns, st.st_size)
+                indexed = self._files.get(journal_file)
+                if indexed is None or indexed[0] != signature:
+                    try:
+                        daterange = entryDateRange(thepath=journal_file)
+                    except (OSError, UnicodeDecodeError, ValueError) as e:
+                        print(f"Failed to find the entry dates of {journal_file}: {e}")
+                        daterange = (datetime.datetime.min, datetime.datetime.max)   # always read, so that the error shows up there
+                    self._files[journal_file] = (signature, daterange)
+                    changed.append((journal_file, signature, daterange))
+
+            removed = [f for f in self._files if f not in seen]
+            for journal_file in removed:
+                del self._files[journal_file]
+
+            if self.snapshot is not None and (len(changed) != 0 or len(removed) != 0):
+                self.snapshot.storeRanges(changed=changed, removed=removed)
+
+    def files(self, start_date, stop_date):
+        """Returns the journal files with entries within [start_date, stop_date], as of the last refresh."""
+        with self._lock:
+            return sorted(journal_file for journal_file, (_, daterange) in self._files.items()
+                          if daterange is not None and daterange[0] <= stop_date and daterange[1] >= start_date)
+
+    def signatures(self):
+        """Returns path -> (st_mtime_ns, st_size) of the journal files, as of the last refresh."""
+        with self._lock:
+            return {} if self._files is None else {journal_file: signature for journal_file, (signature, _) in self._files.items()}
+
+    def stats(self):
+        with self._lock:
+            return {"files": 0 if self._files is None else len(self._files)}
+
+
+class EntryIndex:
+    """In-memory index of all entries below journalpath.
+
+    Entries are kept sorted by date (windows are found by bisection) together with posting lists
+    mapping each tag to its entries. refresh() re-reads only the files whose (st_mtime_ns, st_size)
+    signature changed, and their entries are merged into the sorted list by bisection (the list is
+    only sorted again when many entries changed at once). query() returns copies of the matching
+    entries (see Entry.copy).
+
+    With trigrams=True, queries with a regex pattern are prefiltered by a trigram index of the
+    case-folded entry contents (built on the first such query): only entries containing all
+    trigrams of the literals the pattern requires are candidates, the caller still has to match
+    the regex against them.
+    """
+
+    MIN_TRIGRAM_DEAD = 1000   # compact the trigram index when more entries than this (and than live ones) were removed
+    MERGE_FRACTION = 8   # entries changed since the last query are merged into the sorted list if fewer than 1/MERGE_FRACTION of it
+
+    def __init__(self, notebookpath, journalpath, untaggedtag=UNTAGGED_TAG, date_format=None, snapshot=None, trigrams=True, workers=1):
+        self.notebookpath = notebookpath
+        self.journalpath = journalpath
+        self.untaggedtag = untaggedtag
+        self.date_format = date_format
+        self.snapshot = snapshot   # optional ParseSnapshot, consulted before parsing a file
+        self.workers = workers   # processes for parsing many changed files at once (see parseFiles)
+        self._files = {}   # path -> (signature, entries)
+        self._postings = {}   # tag -> set of entries
+        self._entries = []   # all entries, sorted by date
+        self._dates = []   # dates of self._entries
+        self._tags = []   # sorted keys of self._postings
+        self._added = {}   # entries not yet in self._entries (an ordered set)
+        self._removed = set()   # entries still in self._entries
+        self._tags_dirty = False
+        self._use_trigrams = trigrams
+        self._trigrams = None   # trigram -> array of entry ids, None until the first query with a pattern
+        self._trigram_entries = []   # entry id -> entry, None for removed entries
+        self._trigram_ids = {}   # entry -> entry id
+        self._trigram_dead = 0
+        self._lock = threading.RLock()
+
+    def refresh(self):
+        """Picks up added, modified and removed journal files."""
+        with self._lock:
+            seen = set()
+            changed = []
+            for journal_file, st in _walkFiles(self.journalpath, suffix=MARKDOWN_SUFFIX):
+                seen.add(journal_file)
+                signature = (st.st_mtime_ns, st.st_size)
+                indexed = self._files.get(journal_file)
+                if indexed is None or indexed[0] != signature:
+                    changed.append((journal_file, signature))
+
+            if len(changed) != 0:
+                failed = []
+                for journal_file, signature, entries in _loadEntriesMany(files=changed, notebookpath=self.notebookpath, untaggedtag=self.untaggedtag,
+                                                                         date_format=self.date_format, snapshot=self.snapshot, workers=self.workers,
+                                                                         failed=failed):
+                    self.updateFile(thepath=journal_file, signature=signature, entries=entries)
+                signatures = dict(changed)
+                for journal_file in failed:   # indexed without entries, so that it is only parsed again once it changes
+                    self.updateFile(thepath=journal_file, signature=signatures[journal_file], entries=[])
+
+            for journal_file in [f for f in self._files if f not in seen]:
+                self.removeFile(thepath=journal_file)
+
+    def updateFile(self, thepath, signature=None, entries=None):
+        if signature is None:
+            st = os.stat(thepath)
+            signature = (st.st_mtime_ns, st.st_size)
+
+        if entries is None:
+            entries = _loadEntries(thepath=thepath, notebookpath=self.notebookpath, signature=signature, untaggedtag=self.untaggedtag,
+                                   date_format=self.date_format, snapshot=self.snapshot)
+
+        with self._lock:
+            self.removeFile(thepath=thepath)
+            self._files[thepath] = (signature, entries)
+            for e in entries:
+                for t in e.tags:
+                    posting = self._postings.get(t)
+                    if posting is None:
+                        posting = self._postings[t] = set()
+                        self._tags_dirty = True
+                    posting.add(e)
+                if self._trigrams is not None:
+                    self._addTrigrams(entry=e)
+                self._added[e] = None
+
+    def removeFile(self, thepath):
+        with self._lock:
+            indexed = self._files.pop(thepath, None)
+            if indexed is None:
+                return
+
+            for e in indexed[1]:
+                for t in e.tags:
+                    posting = self._postings.get(t)
+                    if posting is not None:
+                        posting.discard(e)
+                        if len(posting) == 0:
+                            del self._postings[t]
+                            self._tags_dirty = True
+                if self._trigrams is not None:
+                    self._trigram_entries[self._trigram_ids.pop(e)] = None
+                    self._trigram_dead += 1
+                if e in self._added:
+                    del self._added[e]
+                else:
+                    self._removed.add(e)
+            if self._trigram_dead > max(EntryIndex.MIN_TRIGRAM_DEAD, len(self._trigram_ids)):
+                self._trigrams = None   # rebuilt without the removed entries by the next query with a pattern
+
+    def _rebuild(self):
+        # brings self._entries, self._dates and self._tags up to date with the files updated and removed since the last query
+        if len(self._added) != 0 or len(self._removed) != 0:
+            if (len(self._added) + len(self._removed)) * EntryIndex.MERGE_FRACTION > len(self._entries) or not self._merge():
+                self._entries = sorted((e for _, entries in self._files.values() for e in entries), key=lambda e: e.date)
+                self._dates = [e.date for e in self._entries]
+            self._added = {}
+            self._removed = set()
+        if self._tags_dirty:
+            self._tags = sorted(self._postings.keys())
+            self._tags_dirty = False
+
+    def _merge(self):
+        # removes self._removed from and inserts self._added into the sorted lists, False if a removed entry is missing
+        for e in self._removed:
+            i = bisect.bisect_left(self._dates, e.date)
+            while i < len(self._entries) and self._entries[i] is not e and self._dates[i] == e.date:
+                i += 1
+            if i == len(self._entries) or self._entries[i] is not e:
+                return False
+            del self._entries[i]
+            del self._dates[i]
+
+        for e in self._added:   # after the entries of the same date, as sorting would place them
+            i = bisect.bisect_right(self._dates, e.date)
+            self._entries.insert(i, e)
+            self._dates.insert(i, e.date)
+        return True
+
+    def _addTrigrams(self, entry):
+        entry_id = len(self._trigram_entries)
+        self._trigram_entries.append(entry)
+        self._trigram_ids[entry] = entry_id
+        text = _foldcase("\n".join(entry.content))
+        for trigram in {text[i:i + 3] for i in range(len(text) - 2)}:
+            posting = self._trigrams.get(trigram)
+            if posting is None:
+                self._trigrams[trigram] = array.array("I", (entry_id,))
+            else:
+                posting.append(entry_id)
+
+    def _buildTrigrams(self):
+        self._trigrams = {}
+        self._trigram_entries = []
+        self._trigram_ids = {}
+        self._trigram_dead = 0
+        for _, entries in self._files.values():
+            for e in entries:
+                self._addTrigrams(entry=e)
+
+    def _trigramCandidates(self, requirement):
+        # set of ids of entries that may satisfy the requirement (see literalRequirements), None if any entry may
+        if isinstance(requirement, str):
+            literal = _foldcase(requirement)
+            postings = [self._trigrams.get(literal[i:i + 3]) for i in range(len(literal) - 2)]
+            if len(postings) == 0:
+                return None
+            if None in postings:
+                return set()
+            postings.sort(key=len)
+            result = set(postings[0])
+            for posting in postings[1:]:
+                if len(result) == 0:
+                    break
+                result.intersection_update(posting)
+            return result
+
+        parts = [self._trigramCandidates(requirement=r) for r in requirement[1]]
+        if requirement[0] == "and":
+            result = None
+            for part in sorted((p for p in parts if p is not None), key=len):
+                result = part if result is None else result & part
+            return result
+
+        if len(parts) == 0 or None in parts:   # one of the alternatives needs no trigram
+            return None
+        return set().union(*parts)
+
+    def _postingsFor(self, tag, include_subtags):
+        # posting lists of tag and (with include_subtags) of tag + TAG_NAMESPACE_SEPARATOR + ...
+        result = []
+        if tag in self._postings:
+            result.append(self._postings[tag])
+        if include_subtags:
+            prefix = tag + TAG_NAMESPACE_SEPARATOR
+            i = bisect.bisect_left(self._tags, prefix)
+            while i < len(self._tags) and self._tags[i].startswith(prefix):
+                result.append(self._postings[self._tags[i]])
+                i += 1
+        return result
+
+    def query(self, start_date, stop_date, any_tags=None, all_tags=None, include_subtags=True, pattern=None):
+        """Returns copies of the entries within [start_date, stop_date], sorted by date.
+
+        If any_tags is not empty, entries need at least one of these tags (or, with include_subtags,
+        one of their subtags); if all_tags is not empty, entries need all of these tags. If pattern
+        is given, entries that cannot match the regex pattern (case-insensitive) may be left out.
+        """
+        return [e.copy() for e in self._select(start_date=start_date, stop_date=stop_date, any_tags=any_tags, all_tags=all_tags,
+                                                include_subtags=include_subtags, pattern=pattern)]
+
+    def iterQuery(self, start_date, stop_date, any_tags=None, all_tags=None, include_subtags=True, pattern=None):
+        """Like query(), but yields the copies one at a time, e.g. for streaming large windows."""
+        for e in self._select(start_date=start_date, stop_date=stop_date, any_tags=any_tags, all_tags=all_tags,
+                              include_subtags=include_subtags, pattern=pattern):
+            yield e.copy()
+
+    def iterBefore(self, start_date, stop_date, key, before=None, any_tags=None, all_tags=None, include_subtags=True, pattern=None):
+        """Like iterQuery(), but yields the copies newest first by key(entry) descending, for paging.
+
+        key must return a tuple starting with the entry's date. With before (such a tuple), only the
+        entries whose key is less than before are yielded: the window is cut at its date by bisection,
+        and only the entries taken from the generator are copied.
+        """
+        if before is not None and before[0] < stop_date:
+            stop_date = before[0]
+        selected = self._select(start_date=start_date, stop_date=stop_date, any_tags=any_tags, all_tags=all_tags,
+                                include_subtags=include_subtags, pattern=pattern)
+        hi = len(selected)
+        while hi > 0:   # entries of the same date are ordered by key
+            lo = hi - 1
+            while lo > 0 and selected[lo - 1].date == selected[hi - 1].date:
+                lo -= 1
+            for e in sorted(selected[lo:hi], key=key, reverse=True):
+                if before is None or key(e) < before:
+                    yield e.copy()
+            hi = lo
+
+    def _select(self, start_date, stop_date, any_tags, all_tags, include_subtags, pattern):
+        # the indexed entries (not copies) matching a query, see query()
+        with self._lock:
+            self._rebuild()
+            lo = bisect.bisect_left(self._dates, start_date)
+            hi = bisect.bisect_right(self._dates, stop_date)
+
+            any_postings = None
+            if any_tags is not None and len(any_tags) != 0:
+                any_postings = [p for t in any_tags for p in self._postingsFor(tag=t, include_subtags=include_subtags)]
+            all_postings = [] if all_tags is None else [self._postings.get(t, set()) for t in all_tags]
+
+            if pattern is not None and self._use_trigrams:
+                if self._trigrams is None:
+                    self._buildTrigrams()
+                candidate_ids = self._trigramCandidates(requirement=literalRequirements(pattern))
+                if candidate_ids is not None and len(candidate_ids) <= len(self._trigram_ids) // 2:   # else not worth filtering
+                    all_postings.append({self._trigram_entries[i] for i in candidate_ids} - {None})
+
+            if any_postings is None and len(all_postings) == 0:
+                result = self._entries[lo:hi]
+            elif hi - lo <= sum(len(p) for p in (any_postings or [])) + sum(len(p) for p in all_postings):
+                # small window: check the entries of the window against the posting lists
+                result = [e for e in self._entries[lo:hi]
+                          if (any_postings is None or any(e in p for p in any_postings)) and all(e in p for p in all_postings)]
+            else:
+                # few tagged entries: intersect the posting lists, then check the dates
+                candidates = None
+                if any_postings is not None:
+                    candidates = set().union(*any_postings)
+                for p in sorted(all_postings, key=len):
+                    candidates = set(p) if candidates is None else candidates & p
+                result = sorted((e for e in candidates if start_date <= e.date <= stop_date), key=lambda e: e.date)
+
+            return result
+
+    def signatures(self):
+        """Returns path -> (st_mtime_ns, st_size) of the indexed journal files, as of the last refresh."""
+        with self._lock:
+            return {journal_file: signature for journal_file, (signature, _) in self._files.items()}
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._files), "entries": sum(len(entries) for _, entries in self._files.values()), "tags": len(self._postings),
+                    "trigrams": None if self._trigrams is None else len(self._trigrams)}
+
+
+def literalRequirements(pattern):
+    """Returns the literal strings every match of the regex pattern contains, as a tree.
+
+    A requirement is either a literal string, ("and", [requirements]) or ("or", [requirements]);
+    ("and", []) means that nothing is required. Only literals that are certainly part of a match
+    are included (optional parts are skipped).
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, RecursionError):
+        return ("and", [])
+    return _requirements(items=parsed)
+
+
+def _requirements(items):
+    result = []
+    run = []
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            run.append(chr(av))
+            continue
+        if op is sre_constants.AT:   # zero-width, e.g. ^ or \b
+            continue
+
+        if len(run) != 0:
+            result.append("".join(run))
+            run = []
+
+        if op is sre_constants.SUBPATTERN:
+            result.append(_requirements(items=av[-1]))
+        elif op is getattr(sre_constants, "ATOMIC_GROUP", None):
+            result.append(_requirements(items=av))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, getattr(sre_constants, "POSSESSIVE_REPEAT", None)) and av[0] >= 1:
+            result.append(_requirements(items=av[2]))
+        elif op is sre_constants.BRANCH:
+            result.append(("or", [_requirements(items=branch) for branch in av[1]]))
+
+    if len(run) != 0:
+        result.append("".join(run))
+    return ("and", result)
+
+
+def _foldcase(text):
+    # lowercases text such that characters matched by each other with re.IGNORECASE become equal
+    return text.translate(_FOLD_BEFORE_LOWER).lower().translate(_FOLD_AFTER_LOWER)
+
+
+class SearchIndex:
+    """Full-text index (SQLite FTS5, trigram tokenizer) of journal entries and wiki pages.
+
+    Journal entries (files below journalpath) are indexed one row per entry, all other markdown
+    files one row per page. refresh() re-indexes only files whose (st_mtime_ns, st_size)
+    signature changed. The trigram tokenizer matches substrings of at least three characters, so
+    literals required by a regex can be looked up in the index. Contents and literals are indexed
+    and looked up case-folded by _foldcase (as in EntryIndex), which unlike the tokenizer's own
+    case folding agrees with re.IGNORECASE; the original contents are kept for the results.
+
+    Like ParseSnapshot, a corrupt index is deleted and rebuilt, while a locked one is left alone:
+    candidates() then cannot tell, and search() scans the files instead (see _scan).
+    """
+
+    MIN_LITERAL_LENGTH = 3
+    SNIPPET_CONTEXT = 60   # characters around the first match in the snippets, see _snippet
+
+    def __init__(self, notebookpath, journalpath, date_format=None):
+        self.notebookpath = notebookpath
+        self.journalpath = journalpath
+        self.date_format = date_format
+        self.db_path = notebookpath / SEARCH_INDEX_FILENAME
+        self._lock = threading.Lock()
+        try:
+            self._create_tables()
+            with self._connect() as conn:
+                check = conn.execute("PRAGMA quick_check").fetchone()[0]
+            if check != "ok":
+                self._reset(reason="quick_check: " + check)
+        except sqlite3.DatabaseError as e:
+            if "no such" in str(e):   # no such module: fts5 / no such tokenizer: trigram
+                raise
+            self._failed(e)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=SQLITE_BUSY_TIMEOUT)
+
+    def _create_tables(self):
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER,
+                    size INTEGER
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT,
+                    pos INTEGER,
+                    date TEXT,
+                    kind TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_path ON documents (path)")
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(content UNINDEXED, folded, tokenize='trigram')")
+
+    def _failed(self, e):
+        # OperationalError: locked, busy or out of disk space, which passes; anything else means the file is corrupt
+        if isinstance(e, sqlite3.OperationalError):
+            print(f"Search index {self.db_path.as_posix()} unavailable: {e}")
+            return
+        self._reset(reason=e)
+
+    def _reset(self, reason):
+        print(f"Rebuilding search index {self.db_path.as_posix()}: {reason}")
+        try:
+            self.db_path.unlink(missing_ok=True)
+            self._create_tables()
+        except (OSError, sqlite3.DatabaseError) as e:
+            print(f"Failed to rebuild search index: {e}")
+
+    def refresh(self, journal_signatures=None, pages=True):
+        """Indexes added and modified markdown files and drops removed ones.
+
+        journal_signatures, path -> (st_mtime_ns, st_size) of the files below journalpath as just
+        listed by the caller (see EntryIndex.signatures), saves listing the journal again. With
+        pages=False, only the journal files are looked at.
+        """
+        if journal_signatures is None:
+            files = ((thepath, (st.st_mtime_ns, st.st_size)) for thepath, st in _walkFiles(self.journalpath, suffix=MARKDOWN_SUFFIX))
+        else:
+            files = journal_signatures.items()
+        if pages:
+            files = itertools.chain(files, ((thepath, (st.st_mtime_ns, st.st_size))
+                                            for thepath, st in _walkFiles(self.notebookpath, suffix=MARKDOWN_SUFFIX, skip=self.journalpath)))
+
+        with self._lock:
+            try:
+                with self._connect() as conn:
+                    indexed = {path: (mtime_ns, size) for path, mtime_ns, size in conn.execute("SELECT path, mtime_ns, size FROM files")}
+
+                    seen = set()
+                    for thepath, signature in files:
+                        path_key = "/" + thepath.relative_to(self.notebookpath).as_posix()
+                        seen.add(path_key)
+                        if indexed.get(path_key) != signature:
+                            self._indexFile(conn=conn, thepath=thepath, path_key=path_key, signature=signature)
+
+                    for path_key in indexed.keys() - seen:
+                        if pages or self._isJournalFile(path_key):
+                            self._removeFile(conn=conn, path_key=path_key)
+            except sqlite3.DatabaseError as e:
+                self._failed(e)
+
+    def _isJournalFile(self, path_key):
+        return (self.notebookpath / path_key[1:]).is_relative_to(self.journalpath)
+
+    def _documents(self, thepath):
+        # (pos, date, kind, content) of the entries of a journal file, or of the whole page for other files
+        if thepath.is_relative_to(self.journalpath):
+            return [(e.pos, e.date.isoformat(), "entry", "\n".join(e.content))
+                    for e in iterEntries(thepath=thepath, notebookpath=self.notebookpath, date_format=self.date_format)]
+        with open(thepath, "r", encoding="utf-8") as f:
+            return [(0, None, "page", f.read())]
+
+    def _indexFile(self, conn, thepath, path_key, signature):
+        self._removeFile(conn=conn, path_key=path_key)
+
+        try:
+            documents = self._documents(thepath=thepath)
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            print(f"Failed to index {path_key}: {e}")
+            return
+
+        # the deletes above hold the write lock until refresh commits, so no other connection takes these ids meanwhile
+        first_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM documents").fetchone()[0]
+        conn.executemany("INSERT INTO documents (id, path, pos, date, kind) VALUES (?, ?, ?, ?, ?)",
+                         [(first_id + i, path_key, pos, thedate, kind) for i, (pos, thedate, kind, _) in enumerate(documents)])
+        conn.executemany("INSERT INTO search (rowid, content, folded) VALUES (?, ?, ?)",
+                         [(first_id + i, content, _foldcase(content)) for i, (_, _, _, content) in enumerate(documents)])
+        conn.execute("INSERT OR REPLACE INTO files (path, mtime_ns, size) VALUES (?, ?, ?)", (path_key, signature[0], signature[1]))
+
+    def _removeFile(self, conn, path_key):
+        conn.execute("DELETE FROM search WHERE rowid IN (SELECT id FROM documents WHERE path = ?)", (path_key,))
+        conn.execute("DELETE FROM documents WHERE path = ?", (path_key,))
+        conn.execute("DELETE FROM files WHERE path = ?", (path_key,))
+
+    @staticmethod
+    def _match_expression(pattern):
+        # FTS5 query for the literals required by pattern, or None if there are no usable literals
+        def _expression(requirement):
+            if isinstance(requirement, str):
+                literal = _foldcase(requirement)
+                if len(literal) < SearchIndex.MIN_LITERAL_LENGTH:
+                    return None
+                return '"' + literal.replace('"', '""') + '"'
+
+            parts = [_expression(r) for r in requirement[1]]
+            if requirement[0] == "and":
+                parts = [p for p in parts if p is not None]
+                if len(parts) == 0:
+                    return None
+                return "(" + " AND ".join(parts) + ")"
+
+            if len(parts) == 0 or None in parts:   # one of the alternatives needs no literal
+                return None
+            return "(" + " OR ".join(parts) + ")"
+
+        return _expression(literalRequirements(pattern))
+
+    def candidates(self, pattern):
+        """Returns the set of ("/" + rel_path, pos) of journal entries that may match the regex pattern, or None if the index cannot tell."""
+        match_expression = SearchIndex._match_expression(pattern)
+        if match_expression is None:
+            return None
+
+        try:
+            with self._connect() as conn:
+                rows = conn.execute("""
+                    SELECT d.path, d.pos FROM search JOIN documents d ON d.id = search.rowid
+                    WHERE search MATCH ? AND d.kind = 'entry'""", (match_expression,)).fetchall()
+        except sqlite3.DatabaseError as e:
+            self._failed(e)
+            return None
+
+        return set(rows)
+
+    def search(self, q, limit=50):
+        """Returns ranked matches of the regex q (case-insensitive) in journal entries and wiki pages, or None if q has no usable literal.
+
+        Each match is a dict with kind ("entry" or "page"), path, pos, date, rank (bm25, lower is better),
+        snippet and the (start, end) offsets of all matches in the indexed content. If the index cannot
+        be read, the files are scanned instead (see _scan).
+        """
+        regex = re.compile(q, re.IGNORECASE)
+        match_expression = SearchIndex._match_expression(q)
+        if match_expression is None:
+            return None
+
+        try:
+            with self._connect() as conn:
+                rows = conn.execute("""
+                    SELECT d.kind, d.path, d.pos, d.date, bm25(search), search.content
+                    FROM search JOIN documents d ON d.id = search.rowid
+                    WHERE search MATCH ? ORDER BY rank""", (match_expression,))
+
+                result = []
+                for kind, path, pos, thedate, rank, content in rows:
+                    offsets = [m.span() for m in regex.finditer(content)]
+                    if len(offsets) == 0:   # the literals occur, but the regex does not match
+                        continue
+                    result.append({"kind": kind, "path": path, "pos": pos, "date": thedate, "rank": rank,
+                                   "snippet": SearchIndex._snippet(content=content, span=offsets[0]), "offsets": offsets})
+                    if len(result) >= limit:
+                        break
+        except sqlite3.DatabaseError as e:
+            self._failed(e)
+            return self._scan(regex=regex, limit=limit)
+
+        return result
+
+    @staticmethod
+    def _snippet(content, span):
+        # the match at span (start, end) of content, marked, with up to SNIPPET_CONTEXT characters around it
+        start, end = span
+        return ("…" if start > SearchIndex.SNIPPET_CONTEXT else "") + content[max(0, start - SearchIndex.SNIPPET_CONTEXT):start] + \
+               "<mark>" + content[start:end] + "</mark>" + content[end:end + SearchIndex.SNIPPET_CONTEXT] + \
+               ("…" if end + SearchIndex.SNIPPET_CONTEXT < len(content) else "")
+
+    def _scan(self, regex, limit):
+        # search() without the index: matches in path order, without rank
+        result = []
+        for thepath, _ in sorted(_walkFiles(self.notebookpath, suffix=MARKDOWN_SUFFIX)):
+            try:
+                documents = self._documents(thepath=thepath)
+            except (OSError, UnicodeDecodeError, ValueError):
+                continue
+            for pos, thedate, kind, content in documents:
+                offsets = [m.span() for m in regex.finditer(content)]
+                if len(offsets) == 0:
+                    continue
+                result.append({"kind": kind, "path": "/" + thepath.relative_to(self.notebookpath).as_posix(), "pos": pos, "date": thedate,
+                               "rank": None, "snippet": SearchIndex._snippet(content=content, span=offsets[0]), "offsets": offsets})
+                if len(result) >= limit:
+                    return result
+        return result
+
+    def stats(self):
+        try:
+            with self._connect() as conn:
+                files = conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+                documents = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            self._failed(e)
+            return {"error": str(e)}
+        return {"files": files, "documents": documents}
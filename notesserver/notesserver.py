@@ -6,16 +6,29 @@ import os
 import re
 import html
 import urllib
-import urllib.request
+import urllib.parse
+import http.client
+import sqlite3
 from pathlib import Path
 import subprocess
 import importlib
 import json
+import base64
+import binascii
 import shutil
+import sys
+import hashlib
+import time
+import threading
+import concurrent.futures
+import collections
+import bisect
+import itertools
 from werkzeug.utils import secure_filename
-from .noteslib import parseEntries, findTags, writeFile, updateLinks, taggifyLink, MARKDOWN_SUFFIX, ENTRY_PREFIX, TAG_REGEX, TAG_PREFIX, TAG_NAMESPACE_SEPARATOR, JOURNAL_FILE_REGEX, IMAGE_OR_LINK_REGEX
-from datetime import datetime, timedelta
-from flask import Flask, redirect, render_template, request, make_response, send_from_directory, jsonify
+from .backlinkmonitor import BacklinkEngine, BACKLINKS_FILENAME
+from .noteslib import DirectorySnapshots, EntryIndex, JournalManifest, ParseCache, ParseSnapshot, PathIndex, RenderCache, SearchIndex, parseEntries, registerEntryDateFormat, treeSignature, findTags, writeFile, updateLinks, taggifyLink, MARKDOWN_SUFFIX, ENTRY_PREFIX, TAG_REGEX, TAG_PREFIX, TAG_NAMESPACE_SEPARATOR, IMAGE_OR_LINK_REGEX
+from datetime import datetime, timedelta, timezone
+from flask import Flask, Response, redirect, render_template, stream_template, request, make_response, send_from_directory, jsonify
 from markdown_it import MarkdownIt
 from mdit_py_plugins.attrs import attrs_plugin
 from mdit_py_plugins.footnote import footnote_plugin
@@ -44,12 +57,15 @@ NOTEBOOK_PATH = Path(config.get("NOTEBOOK_PATH", ".")).resolve()
 NOTEBOOK_NAME = config.get("NOTEBOOK_NAME", NOTEBOOK_PATH.name)
 BASIC_SECRET = config.get("BASIC_SECRET", None)
 DEFAULT_JOURNAL_TIMEWINDOW_IN_WEEKS = config.get('DEFAULT_JOURNAL_TIMEWINDOW_IN_WEEKS', 2)
+JOURNAL_PAGE_SIZE = config.get('JOURNAL_PAGE_SIZE', 200)   # journal entries rendered per page view, more are loaded while scrolling; 0 renders all
+STREAM_JOURNAL_PAGES = config.get('STREAM_JOURNAL_PAGES', True)   # send journal pages while rendering them instead of building them in memory first
 JOURNAL_ENTRY_DATE_FORMAT = config.get('JOURNAL_ENTRY_DATE_FORMAT', '%a %d.%m. %H:%M')
 
 NEW_JOURNAL_ENTRY_DEFAULT_TAGS_LIST = config.get('NEW_JOURNAL_ENTRY_DEFAULT_TAGS_LIST', ["inbox"])
 NEW_ENTRY_PREFER_REFS = config.get('NEW_ENTRY_PREFER_REFS', False)
 SORT_TAGS_BY_NAME = config.get('SORT_TAGS_BY_NAME', False)
 HIDE_DOTFILES = config.get('HIDE_DOTFILES', True)
+FOLDER_PAGE_SIZE = config.get('FOLDER_PAGE_SIZE', 500)   # entries per page of folder listings; 0 lists all entries on one page
 
 EDITOR_COMMAND_LIST = _set_editor_path(command_list=config.get("EDITOR_COMMAND_LIST", ["code", "{filepath}"]))
 EDITOR_GOTO_COMMAND_LIST = _set_editor_path(command_list=config.get("EDITOR_GOTO_COMMAND_LIST", ["code", "--goto", "{filepath}:{line_no}"]))
@@ -66,7 +82,25 @@ MEDIA_PATH = NOTEBOOK_PATH / config.get("MEDIA_PATH", "media")
 NO_ADDITIONAL_TAGS = config.get("NO_ADDITIONAL_TAGS", "[only selected tags]")
 INCLUDE_SUBTAGS = config.get("INCLUDE_SUBTAGS", True)
 
+EXTRA_ENTRY_DATE_FORMATS = config.get("EXTRA_ENTRY_DATE_FORMATS", [])   # list of [regex, strptime format], e.g. [["(\\d{2}\\.\\d{2}\\.\\d{4}) ?(.*)", "%d.%m.%Y"]]
+for extra_regex, extra_date_format in EXTRA_ENTRY_DATE_FORMATS:
+    registerEntryDateFormat(regex=extra_regex, date_format=extra_date_format)
+
+PARSE_CACHE_MAX_MB = config.get("PARSE_CACHE_MAX_MB", 256)   # memory budget for parsed journal files with USE_ENTRY_INDEX = False (the entry index holds all entries), 0 disables caching
+USE_ENTRY_INDEX = config.get("USE_ENTRY_INDEX", True)   # keep all journal entries indexed in memory; if False, parse (and cache) the relevant files per request
+USE_TRIGRAM_INDEX = config.get("USE_TRIGRAM_INDEX", True)   # in-memory trigram index of the entry index to prefilter the q search
+USE_SEARCH_INDEX = config.get("USE_SEARCH_INDEX", False)   # full-text index (SQLite FTS5) in NOTEBOOK_PATH/.search_v*.sqlite for the q search and /_search
+PARSE_SNAPSHOT = config.get("PARSE_SNAPSHOT", True)   # persist parsed journal files in NOTEBOOK_PATH/.parsecache_v*.sqlite for fast restarts
+RENDER_CACHE_MAX_MB = config.get("RENDER_CACHE_MAX_MB", 64)   # memory budget for the rendered HTML of journal entries, set to 0 to disable caching
+PAGE_CACHE_MAX_MB = config.get("PAGE_CACHE_MAX_MB", 32)   # memory budget for rendered wiki pages, set to 0 to disable caching
+TAG_PAGE_INDEX_MAX_MB = config.get("TAG_PAGE_INDEX_MAX_MB", 8)   # memory budget for the directory listings used to find tag pages, set to 0 to disable caching
+PARSE_WORKERS = config.get("PARSE_WORKERS", None)   # processes for parsing many journal files at once (cold start); None: one per CPU, 1: no worker processes
+CONDITIONAL_PAGE_RESPONSES = config.get("CONDITIONAL_PAGE_RESPONSES", True)   # answer page reloads with 304 Not Modified (ETag/Last-Modified) if no file the page depends on changed
+
 BACKLINKS_SERVER_URL = config.get("BACKLINKS_SERVER_URL", "http://127.0.0.1:5001")
+BACKLINKS_IN_PROCESS = config.get("BACKLINKS_IN_PROCESS", True)   # read backlinks from the database backlinkmonitor.py keeps current; the server is only asked if that fails
+BACKLINKS_TIMEOUT = config.get("BACKLINKS_TIMEOUT", 2.0)   # seconds to wait for the backlinks server
+BACKLINKS_DEADLINE = config.get("BACKLINKS_DEADLINE", 0.5)   # seconds after which a page is rendered without backlinks (and sent with no-store) if they are not there yet; None waits
 
 TASKS = config.get("TASKS", {})
 BLUEPRINT_MODULES = config.get("BLUEPRINT_MODULES", {})
@@ -77,6 +111,37 @@ SECRET_COOKIE_NAME = 'basic_secret'
 SECRET_COOKIE_MAX_AGE=365*24*60*60
 ACCESS_DENIED_MESSAGE_DICT = {"error": "access denied: invalid secret. Please go to <a href=\"/_set_key\">/_set_key</a> to set the secret."}
 HEADING_REGEX = re.compile(r'^(#{1,6})\s+(.*)$')
+STREAM_CHUNK_SIZE = 8192   # characters per chunk of streamed pages
+FOLDER_SORT_KEYS = {"name": lambda c: c[0].lower(),   # c: (name, is_dir, st_mtime, st_size), see DirectorySnapshots
+                    "mtime": lambda c: (-1 if c[2] is None else c[2], c[0].lower()),
+                    "size": lambda c: (-1 if c[3] is None else c[3], c[0].lower())}
+BACKLINKS_WORKERS = 4   # threads looking up backlinks while pages are rendered
+PAGE_VALIDATORS_MAX = 1024   # pages whose tag page directories are remembered for conditional responses
+SERVER_START = datetime.now().isoformat()   # part of every page validator, so that templates and config changed by a restart are picked up
+
+BACKLINK_ENGINE = BacklinkEngine(notebookpath=NOTEBOOK_PATH, readonly=True) if BACKLINKS_IN_PROCESS else None
+BACKLINKS_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=BACKLINKS_WORKERS, thread_name_prefix="backlinks")   # see _start_backlinks
+BACKLINKS_BUSY = threading.BoundedSemaphore(BACKLINKS_WORKERS)   # held by each lookup submitted to BACKLINKS_POOL until it is done
+BACKLINKS_CONNECTIONS = threading.local()   # keep-alive connection to BACKLINKS_SERVER_URL per thread, see _backlinks_server_get
+PAGE_TAG_DIRS = collections.OrderedDict()   # base page validator -> directories of the tag pages linked by the last render, see _page_validator
+PAGE_TAG_DIRS_LOCK = threading.Lock()
+PARSE_SNAPSHOT_DB = ParseSnapshot(notebookpath=NOTEBOOK_PATH) if PARSE_SNAPSHOT else None
+RENDER_CACHE = RenderCache(max_bytes=RENDER_CACHE_MAX_MB * 1024 * 1024)
+PAGE_RENDER_CACHE = RenderCache(max_bytes=PAGE_CACHE_MAX_MB * 1024 * 1024)
+DIRECTORY_SNAPSHOTS = DirectorySnapshots()
+TAG_PAGE_INDEX = PathIndex(notebookpath=NOTEBOOK_PATH, max_bytes=TAG_PAGE_INDEX_MAX_MB * 1024 * 1024)   # revalidated once per request, see create_app
+PARSE_CACHE = ParseCache(max_bytes=PARSE_CACHE_MAX_MB * 1024 * 1024, snapshot=PARSE_SNAPSHOT_DB, workers=PARSE_WORKERS)
+SEARCH_INDEX_MIN_ENTRIES = 200   # below this many entries in the window, scanning them is cheaper than asking the search index
+JOURNAL_MANIFEST = JournalManifest(notebookpath=NOTEBOOK_PATH, journalpath=JOURNAL_PATH, snapshot=PARSE_SNAPSHOT_DB) if not USE_ENTRY_INDEX else None
+ENTRY_INDEX = EntryIndex(notebookpath=NOTEBOOK_PATH, journalpath=JOURNAL_PATH, date_format=JOURNAL_ENTRY_DATE_FORMAT, snapshot=PARSE_SNAPSHOT_DB,
+                         trigrams=USE_TRIGRAM_INDEX, workers=PARSE_WORKERS) if USE_ENTRY_INDEX else None
+
+SEARCH_INDEX = None
+if USE_SEARCH_INDEX:
+    try:
+        SEARCH_INDEX = SearchIndex(notebookpath=NOTEBOOK_PATH, journalpath=JOURNAL_PATH, date_format=JOURNAL_ENTRY_DATE_FORMAT)
+    except Exception as e:
+        print(f"Search index not available: {e}")
 
 QUICKLAUNCH_HTML = None
 QUICKLAUNCH_PATH = NOTEBOOK_PATH / ".quicklaunch.html"
@@ -146,147 +211,560 @@ def remove_tag(rel_path: str, entryId: str, tag_to_remove: str):
 
 
 def _link_tag_pages(m, tagWikiPages):
-    thetag = m.group(2)
+    thetag = m.group(2).lower()   # as in findTags, so that entry tags and the sidebar share the same tagWikiPages keys
     if thetag not in tagWikiPages:
         tagWikiPages[thetag] = _find_tag_wiki_page(tag=thetag)
     tag_page = tagWikiPages[thetag]
 
-    return m.group(1) + "<span class=\"tag-pill\"><a class=\"taglink\" href=\"" + html.escape(tag_page[0]) + "\">" + ("🗏 " if tag_page[1] else "") + html.escape(thetag) + "</a></span>"
+    return m.group(1) + "<span class=\"tag-pill\"><a class=\"taglink\" href=\"" + html.escape(tag_page[0]) + "\">" + ("🗏 " if tag_page[1] else "") + html.escape(m.group(2)) + "</a></span>"
+
+
+def _render_entry(content, tagWikiPages):
+    # rendered HTML of an entry's content lines, cached by content hash. The cached HTML is only valid
+    # as long as the tag pages it links to are unchanged: if a tag page was created or deleted since,
+    # all cached entries mentioning that tag are dropped.
+    text = "\n".join(content)
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    cached = RENDER_CACHE.get(key)
+    if cached is not None:
+        rendered, tag_pages = cached
+        changed_tags = []
+        for thetag, tag_page in tag_pages:
+            if thetag not in tagWikiPages:
+                tagWikiPages[thetag] = _find_tag_wiki_page(tag=thetag)
+            if tagWikiPages[thetag] != tag_page:
+                changed_tags.append(thetag)
+
+        if len(changed_tags) == 0:
+            return rendered
+        RENDER_CACHE.invalidateTags(changed_tags)
+
+    econtent = []
+    tags = {}
+    for line in content:
+        econtent.append(TAG_REGEX.sub(lambda m: _link_tag_pages(m=m, tagWikiPages=tagWikiPages), line))
+        for m in TAG_REGEX.finditer(line):
+            tags[m.group(2).lower()] = True
+    rendered = md.render("\n".join(econtent))
+
+    RENDER_CACHE.put(key=key, value=(rendered, tuple((t, tagWikiPages[t]) for t in tags)), tags=tags.keys(), size=sys.getsizeof(rendered) + sys.getsizeof(text))
+    return rendered
+
+
+def _iter_entries_from_files(start_date, stop_date, prefetch=False):
+    # only files with entries in the window, according to their recorded date ranges
+    JOURNAL_MANIFEST.refresh()
+    relevant_files = JOURNAL_MANIFEST.files(start_date=start_date, stop_date=stop_date)
+
+    if prefetch:
+        PARSE_CACHE.prefetch(paths=relevant_files, notebookpath=NOTEBOOK_PATH, date_format=JOURNAL_ENTRY_DATE_FORMAT)
+    for journal_file in relevant_files:
+        yield from PARSE_CACHE.entries(thepath=journal_file, notebookpath=NOTEBOOK_PATH, start_date=start_date, stop_date=stop_date, date_format=JOURNAL_ENTRY_DATE_FORMAT)
+
+
+def _journal_signatures():
+    # (st_mtime_ns, st_size) of the journal files as of the last refresh of the entry index or the manifest
+    return ENTRY_INDEX.signatures() if ENTRY_INDEX is not None else JOURNAL_MANIFEST.signatures()
+
+
+def _selected_tags_search(selected_tags):
+    # selected tags without NO_ADDITIONAL_TAGS (None if there are none), and whether NO_ADDITIONAL_TAGS is selected
+    if selected_tags is None or len(selected_tags) == 0:
+        return None, False
+
+    selected_tags_search = list(selected_tags)
+    if NO_ADDITIONAL_TAGS in selected_tags_search:
+        selected_tags_search.remove(NO_ADDITIONAL_TAGS)
+        return selected_tags_search, True
+    return selected_tags_search, False
+
+
+def _filter_entries(entries, related_tags, selected_tags_search, no_additional_selected, regex, candidates=None):
+    # yields the entries that have one of related_tags (None: no such filter), all selected tags and a line matching regex;
+    # candidates optionally restricts the result to these ("/" + rel_path, pos) pairs beforehand
+    for entry in entries:
+        # at least one tag from related_tags needs to be present
+        if related_tags is not None and len(related_tags) != 0:
+            if not any(related_tag == t or (INCLUDE_SUBTAGS and t.startswith(related_tag + TAG_NAMESPACE_SEPARATOR))
+                       for related_tag in related_tags for t in entry["tags"]):
+                continue
+
+        # Then apply tag filtering (entry must have all selected tags)
+        if selected_tags_search is not None:
+            if not all(tag in entry["tags"] for tag in selected_tags_search):
+                continue
+
+            has_no_additional_tags = False
+            if len(entry["tags"]) == len(selected_tags_search):
+                entry["tags"].append(NO_ADDITIONAL_TAGS)
+                has_no_additional_tags = True
+
+            if no_additional_selected and not has_no_additional_tags:
+                continue
+
+        if candidates is not None and ("/" + entry.rel_path.as_posix(), entry.pos) not in candidates:
+            continue
+
+        # apply regex filter if compiled
+        if regex is not None and not any(regex.search(t) for t in entry.get('content', [])):
+            continue
+
+        yield entry
 
 
 def get_entries(start_date, stop_date, related_tags, selected_tags, q):
-    # month to quarter: (i-1)//3+1
-
-    relevant_files = []
-    result = []
-    for journal_file in JOURNAL_PATH.glob("**/*.md"):
-        m = JOURNAL_FILE_REGEX.match(journal_file.name)
-        if m is not None:
-            year = int(m.group(1))
-            quarter = int(m.group(2))
-            quarter_month = ((quarter - 1) * 3) + 1
-            journal_file_earliest_date = datetime(year=year, month=quarter_month, day=1)
-
-            next_quarter = quarter + 1
-            next_quarter_year = year
-            if next_quarter > 4:
-                next_quarter = 1
-                next_quarter_year += 1
-            next_quarter_month = ((next_quarter - 1) * 3) + 1
-            journal_file_latest_date = datetime(year=next_quarter_year, month=next_quarter_month, day=1) - timedelta(microseconds=1)
-
-            mdate = datetime.fromtimestamp(journal_file.stat().st_mtime)
-            if mdate > journal_file_latest_date:
-                journal_file_latest_date = mdate
-
-            if not (start_date > journal_file_latest_date or stop_date < journal_file_earliest_date):
-                relevant_files.append(journal_file)
-
-        else:   # journal file name did not match regex, not sure what's in --> parsing that file:", journal_file.name)
-            relevant_files.append(journal_file)
+    selected_tags_search, no_additional_selected = _selected_tags_search(selected_tags=selected_tags)
 
-    for journal_file in relevant_files:
-        parsed_entries = parseEntries(thepath=journal_file, notebookpath=NOTEBOOK_PATH, date_format=JOURNAL_ENTRY_DATE_FORMAT)["entries"]
-        for entry in parsed_entries:
-            if entry["date"] >= start_date and entry["date"] <= stop_date:
-                result.append(entry)
-        parsed_entries = None
-
-    # at least one tag from related_tags needs to be present
-    result_tmp = []
-    if related_tags is not None and len(related_tags) != 0:
-        for entry in result:
-            added_this = False
-
-            for related_tag in related_tags:
-                for t in entry["tags"]:
-                    if related_tag == t or (INCLUDE_SUBTAGS and t.startswith(related_tag + TAG_NAMESPACE_SEPARATOR)):
-                        result_tmp.append(entry)
-                        added_this = True
-                        break
-
-                if added_this:
-                    break
+    regex = None
+    if q is not None and len(q) != 0:
+        try:
+            regex = re.compile(q, re.IGNORECASE)
+        except re.error:
+            # invalid regex: produce no matches and flag error
+            return [], True
+
+    candidates = None
+    if ENTRY_INDEX is not None:
+        ENTRY_INDEX.refresh()
+        # with a regex, the index leaves out entries that lack the trigrams of its required literals
+        result = ENTRY_INDEX.query(start_date=start_date, stop_date=stop_date, any_tags=related_tags, all_tags=selected_tags_search,
+                                   include_subtags=INCLUDE_SUBTAGS, pattern=None if regex is None else q)
+        related_tags = None   # already applied by the index
+    else:
+        result = list(_iter_entries_from_files(start_date=start_date, stop_date=stop_date, prefetch=True))
+
+    if regex is not None and SEARCH_INDEX is not None and len(result) > SEARCH_INDEX_MIN_ENTRIES:
+        # only entries containing the literals required by the regex can match; the journal was just listed by the refresh above
+        SEARCH_INDEX.refresh(journal_signatures=_journal_signatures(), pages=False)
+        candidates = SEARCH_INDEX.candidates(q)
+
+    return list(_filter_entries(entries=result, related_tags=related_tags, selected_tags_search=selected_tags_search,
+                                no_additional_selected=no_additional_selected, regex=regex, candidates=candidates)), False
+
+
+def iter_entries_before(start_date, stop_date, related_tags, selected_tags, q, after):
+    """Like get_entries, but yields the entries newest first (by _entry_sort_key) whose sort key is less than after.
+
+    With the entry index, entries are only copied and filtered as far as they are taken from the generator,
+    so a page costs about its size rather than the number of matches.
+    """
+    selected_tags_search, no_additional_selected = _selected_tags_search(selected_tags=selected_tags)
+
+    if ENTRY_INDEX is None:
+        entries, _ = get_entries(start_date=start_date, stop_date=stop_date, related_tags=related_tags, selected_tags=selected_tags, q=q)
+        entries.sort(key=_entry_sort_key)
+        yield from reversed(entries[:bisect.bisect_left([_entry_sort_key(e) for e in entries], after)])
+        return
 
-        result = result_tmp
-
-    # Then apply tag filtering (entry must have all selected tags)
-    if selected_tags is not None and len(selected_tags) != 0:
-        selected_tags_search = list(selected_tags)
-        no_additional_selected = False
-        if NO_ADDITIONAL_TAGS in selected_tags_search:
-            selected_tags_search.remove(NO_ADDITIONAL_TAGS)
-            no_additional_selected = True
-
-        result_tmp = []
-        for entry in result:
-            if all(tag in entry["tags"] for tag in selected_tags_search):
-                has_no_additional_tags = False
-                if len(entry["tags"]) == len(selected_tags_search):
-                    entry["tags"].append(NO_ADDITIONAL_TAGS)
-                    has_no_additional_tags = True
-
-                if not no_additional_selected or has_no_additional_tags:
-                    result_tmp.append(entry)
-        result = result_tmp
-
-    regex_error = False
     regex = None
     if q is not None and len(q) != 0:
         try:
             regex = re.compile(q, re.IGNORECASE)
         except re.error:
-            regex_error = True
-            result = []
+            return
+
+    ENTRY_INDEX.refresh()
+    # with a regex, the index leaves out entries that lack the trigrams of its required literals
+    entries = ENTRY_INDEX.iterBefore(start_date=start_date, stop_date=stop_date, key=_entry_sort_key, before=after, any_tags=related_tags,
+                                     all_tags=selected_tags_search, include_subtags=INCLUDE_SUBTAGS, pattern=None if regex is None else q)
+    yield from _filter_entries(entries=entries, related_tags=None, selected_tags_search=selected_tags_search,
+                               no_additional_selected=no_additional_selected, regex=regex)
+
+
+def iter_entries(start_date, stop_date, selected_tags, regex):
+    """Like get_entries (without related tags), but yields the entries one at a time without collecting them first."""
+    selected_tags_search, no_additional_selected = _selected_tags_search(selected_tags=selected_tags)
 
-        # apply regex filter if compiled; if invalid regex produce no matches and flag error
-        if not regex_error and regex is not None:
-            def matches_regex(entry):
-                for t in entry.get('content', []):
-                    if regex.search(t):
-                        return True
+    if ENTRY_INDEX is not None:
+        ENTRY_INDEX.refresh()
+        entries = ENTRY_INDEX.iterQuery(start_date=start_date, stop_date=stop_date, all_tags=selected_tags_search, include_subtags=INCLUDE_SUBTAGS,
+                                        pattern=None if regex is None else regex.pattern)
+    else:
+        entries = _iter_entries_from_files(start_date=start_date, stop_date=stop_date)
+
+    yield from _filter_entries(entries=entries, related_tags=None, selected_tags_search=selected_tags_search,
+                               no_additional_selected=no_additional_selected, regex=regex)
+
+
+def _coalesce_chunks(chunks):
+    # template streaming yields many tiny strings; send them in chunks of about STREAM_CHUNK_SIZE characters
+    buffered = []
+    buffered_size = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        buffered_size += len(chunk)
+        if buffered_size >= STREAM_CHUNK_SIZE:
+            yield "".join(buffered)
+            buffered = []
+            buffered_size = 0
+
+    if len(buffered) != 0:
+        yield "".join(buffered)
+
+
+def _parse_window(start_str, stop_str, today_date):
+    # default start = today - DEFAULT_JOURNAL_TIMEWINDOW_IN_WEEKS weeks, default stop = end of today: whole days, so that
+    # the entries in the default window only change with the journal files or the date (see _page_validator)
+    today_start = datetime(today_date.year, today_date.month, today_date.day)
+    default_start_date = today_start - timedelta(weeks=DEFAULT_JOURNAL_TIMEWINDOW_IN_WEEKS)
+    default_stop_date = today_start + timedelta(days=1) - timedelta(microseconds=1)
+
+    # If user provided a start date, try to parse it; otherwise use default
+    start_date = default_start_date
+    stop_date = default_stop_date
+    if start_str is not None and len(start_str) != 0:
+        try:
+            parsed = datetime.strptime(start_str, '%Y-%m-%d')
+            start_date = parsed
+        except Exception:
+            start_date = default_start_date
+    if stop_str is not None and len(stop_str) != 0:
+        try:
+            parsed = datetime.strptime(stop_str, '%Y-%m-%d') + timedelta(days=1) - timedelta(microseconds=1)
+            stop_date = parsed
+        except Exception:
+            stop_date = default_stop_date
 
-                return False
-            result = [e for e in result if matches_regex(e)]
+    return start_date, stop_date
 
-    return result, regex_error
 
+def _entry_sort_key(entry):
+    return entry.date, entry.rel_path.as_posix(), entry.pos
 
-def _get_backlinks(file_path: str):
-    if BACKLINKS_SERVER_URL is not None:
-        url = BACKLINKS_SERVER_URL + "/" + file_path
+
+def _encode_cursor(query_state, after):
+    return base64.urlsafe_b64encode(json.dumps(dict(query_state, after=after)).encode("utf-8")).decode("ascii")
+
+
+def _is_str_list(value):
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def _decode_cursor(cursor):
+    # returns (query_state, sort key of the last entry already sent), or None if cursor is invalid
+    try:
+        query_state = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        after = query_state.pop("after")
+        if len(after) != 3 or not isinstance(after[1], str) or type(after[2]) is not int:
+            return None
+        after = (datetime.fromisoformat(after[0]), after[1], after[2])
+        datetime.fromisoformat(query_state["start"])
+        datetime.fromisoformat(query_state["stop"])
+        if not _is_str_list(query_state["selected_tags"]) or not (query_state["related_tags"] is None or _is_str_list(query_state["related_tags"])) or not isinstance(query_state["q"], str):
+            return None
+    except (ValueError, KeyError, TypeError, IndexError, AttributeError, binascii.Error):
+        return None
+    return query_state, after
+
+
+def _journal_page(entries, query_state):
+    # entries newest first (an iterable, only taken as far as needed): returns the first JOURNAL_PAGE_SIZE of them,
+    # and the cursor for the entries after those (None if there are none)
+    if not JOURNAL_PAGE_SIZE:
+        return list(entries), None
+
+    page = list(itertools.islice(entries, JOURNAL_PAGE_SIZE + 1))
+    if len(page) <= JOURNAL_PAGE_SIZE:
+        return page, None
+
+    del page[JOURNAL_PAGE_SIZE:]
+    last = _entry_sort_key(page[-1])
+    return page, _encode_cursor(query_state=query_state, after=[last[0].isoformat(), last[1], last[2]])
+
+
+def _backlinks_server_get(path):
+    # decoded JSON response of the backlinks server for path, over the current thread's keep-alive connection.
+    # A reused connection may have been closed by the server in the meantime; then it is reopened once.
+    server = urllib.parse.urlsplit(BACKLINKS_SERVER_URL)
+    conn = getattr(BACKLINKS_CONNECTIONS, "conn", None)
+    reused = conn is not None
+
+    while True:
+        if conn is None:
+            connection_class = http.client.HTTPSConnection if server.scheme == "https" else http.client.HTTPConnection
+            conn = connection_class(server.hostname, server.port, timeout=BACKLINKS_TIMEOUT)
+            BACKLINKS_CONNECTIONS.conn = conn
 
         try:
-            with urllib.request.urlopen(url) as response:
-                # 1. Read bytes and decode to string
-                bytes_data = response.read()
-                json_str = bytes_data.decode('utf-8')
+            conn.request("GET", server.path.rstrip("/") + urllib.parse.quote(path))
+            response = conn.getresponse()
+            bytes_data = response.read()
+        except TimeoutError:
+            conn.close()
+            BACKLINKS_CONNECTIONS.conn = None
+            raise
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            BACKLINKS_CONNECTIONS.conn = None
+            if not reused:
+                raise
+            conn = None
+            reused = False
+            continue
+
+        if response.status != 200:
+            raise http.client.HTTPException(f"{response.status} {response.reason}")
+        return json.loads(bytes_data.decode('utf-8'))
+
+
+def _start_backlinks(file_path):
+    # starts looking up the backlinks of file_path on BACKLINKS_POOL, see _join_backlinks. Returns None without starting
+    # it while every worker is busy, e.g. with lookups still waiting for a hung backlinks server after their pages
+    # were rendered without them: queued behind those, it would miss its deadline, too
+    if not BACKLINKS_BUSY.acquire(blocking=False):
+        return None
+
+    def lookup():
+        lookup_started = time.perf_counter()
+        return _get_backlinks(file_path), time.perf_counter() - lookup_started
+
+    try:
+        future = BACKLINKS_POOL.submit(lookup)
+    except RuntimeError:   # the pool was shut down
+        BACKLINKS_BUSY.release()
+        return None
+    future.add_done_callback(lambda _: BACKLINKS_BUSY.release())   # also called if cancelled
+    return future, time.perf_counter()
+
+
+def _join_backlinks(lookup, timings):
+    # (backlinks started by _start_backlinks, finished): backlinks is None and finished False if they were not started or
+    # are not there BACKLINKS_DEADLINE seconds after the start (then the lookup is cancelled unless it is running already);
+    # see _set_page_cacheability.
+    # Adds to timings (seconds): "page" (work done meanwhile), "backlinks" (lookup, if finished) and "backlinks-wait" (blocked here)
+    if lookup is None:
+        print("Backlinks not looked up, all workers are busy")
+        return None, False
+
+    future, started = lookup
+    joined = time.perf_counter()
+    timeout = None if BACKLINKS_DEADLINE is None else max(0.0, started + BACKLINKS_DEADLINE - joined)
+    try:
+        backlinks, timings["backlinks"] = future.result(timeout=timeout)
+        finished = True
+    except concurrent.futures.TimeoutError:
+        print(f"Backlinks not there after {BACKLINKS_DEADLINE} s, rendering without them")
+        future.cancel()
+        backlinks = None
+        finished = False
+
+    timings["page"] = joined - started
+    timings["backlinks-wait"] = time.perf_counter() - joined
+    return backlinks, finished
+
+
+def _server_timing(timings):
+    # Server-Timing header value, shown per request in the browser's developer tools
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
 
-                # 2. Parse string into Python object
-                return json.loads(json_str)
+def _get_backlinks(file_path: str):
+    if BACKLINK_ENGINE is not None:
+        try:
+            return BACKLINK_ENGINE.get_backlinks(file_path)
+        except (sqlite3.Error, ValueError) as e:   # e.g. the database was not created yet
+            print(f"Failed to read backlinks: {e}")
 
+    if BACKLINKS_SERVER_URL is not None:
+        try:
+            return _backlinks_server_get("/" + file_path)
         except Exception as e:
             print(f"Failed to fetch data: {e}")
 
     return None
 
 
+def _format_size(size):
+    if size is None:
+        return ""
+    if size < 1024:
+        return f"{size} B"
+    for unit in ("KB", "MB", "GB"):
+        size /= 1024
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}"
+
+
+def _folder_listing(p, sort, descending, page):
+    # (entries of the given page, page, number of pages) of the folder p: folders first, then files sorted by FOLDER_SORT_KEYS[sort].
+    # Sorted and shown by the mtime and size in the snapshot, without a stat per file: a file modified in place keeps
+    # its old values until the folder changes (a file is created, deleted or renamed), see DirectorySnapshots
+    folders = []
+    files = []
+    for child in DIRECTORY_SNAPSHOTS.snapshot(p):
+        if HIDE_DOTFILES and child[0].startswith("."):
+            continue
+        if child[1]:
+            folders.append(child)
+        else:
+            files.append(child)
+
+    folders.sort(key=FOLDER_SORT_KEYS["name"], reverse=descending and sort == "name")
+    files.sort(key=FOLDER_SORT_KEYS[sort], reverse=descending)
+    children = folders + files
+
+    page_count = 1
+    if FOLDER_PAGE_SIZE > 0:
+        page_count = max(1, (len(children) + FOLDER_PAGE_SIZE - 1) // FOLDER_PAGE_SIZE)
+        page = min(max(page, 1), page_count)
+        children = children[(page - 1) * FOLDER_PAGE_SIZE:page * FOLDER_PAGE_SIZE]
+    else:
+        page = 1
+
+    folder_path = "/" if p == NOTEBOOK_PATH else "/" + p.relative_to(NOTEBOOK_PATH).as_posix() + "/"
+    entries = []
+    for name, is_dir, mtime, size in children:
+        if is_dir:
+            entries.append({"name": name, "is_folder": True, "absolute_path": folder_path + name + "/"})
+            continue
+
+        entries.append({"name": name, "is_folder": False, "absolute_path": folder_path + name,
+                        "mtime": "" if mtime is None else datetime.fromtimestamp(mtime).strftime("%d.%m.%Y %H:%M"), "size": _format_size(size)})
+
+    return entries, page, page_count
+
+
 def _find_tag_wiki_page(tag):
     tag_path_str = tag.replace(TAG_NAMESPACE_SEPARATOR, "/")
-    tag_path = NOTEBOOK_PATH / (tag_path_str + MARKDOWN_SUFFIX)
+    tag_path = (NOTEBOOK_PATH / (tag_path_str + MARKDOWN_SUFFIX)).relative_to(NOTEBOOK_PATH)
+
+    wiki_page = TAG_PAGE_INDEX.find(rel_path=tag_path)
+    if wiki_page is not None:
+        return ("/" + wiki_page.as_posix(), True)
+
+    return ("/" + tag_path.as_posix(), False)
+
+
+def _page_validator(page_file):
+    # (base validator, latest st_mtime_ns) of a wiki page (page_file) or the journal page (page_file None), from stats only:
+    # the request, today's date (latest journal page), the journal window computed by _parse_window, the page file, all journal files
+    # and the backlinks database. Which tag pages exist is not known before rendering; see _page_etag.
+    today_date = datetime.now()
+    start_date, stop_date = _parse_window(start_str=request.args.get('start', None), stop_str=request.args.get('stop', None), today_date=today_date)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{SERVER_START}\0{request.path}\0{today_date.date().isoformat()}\0{start_date.isoformat()}\0{stop_date.isoformat()}\0".encode("utf-8", "surrogateescape"))
+    digest.update(request.query_string)
+
+    journal_digest, latest = treeSignature(JOURNAL_PATH)
+    digest.update(journal_digest.encode("ascii"))
+
+    # the backlinks database and its WAL (not -shm: readers touch it, which would change the ETag on every request)
+    backlinks_db = NOTEBOOK_PATH / BACKLINKS_FILENAME
+    dependencies = [backlinks_db, backlinks_db.with_name(backlinks_db.name + "-wal")]
+    if page_file is not None:
+        dependencies.insert(0, page_file)
+    for dependency in dependencies:
+        try:
+            st = dependency.stat()
+        except OSError:
+            digest.update(f"\0{dependency}\0missing".encode("utf-8", "surrogateescape"))
+            continue
+        digest.update(f"\0{dependency}\0{st.st_mtime_ns}\0{st.st_size}".encode("utf-8", "surrogateescape"))
+        latest = max(latest, st.st_mtime_ns)
+
+    return digest.hexdigest(), latest
+
+
+def _page_etag(validator, tag_dirs):
+    # (ETag, Last-Modified) of a page: its base validator plus the directories of its tag pages, whose mtimes change
+    # whenever a tag page is created, deleted or renamed (which changes the tag links on the page)
+    base, latest = validator
+    digest = hashlib.blake2b(base.encode("ascii"), digest_size=16)
+    for tag_dir in tag_dirs:
+        try:
+            mtime_ns = os.stat(tag_dir).st_mtime_ns
+        except OSError:
+            mtime_ns = -1
+        digest.update(f"\0{tag_dir}\0{mtime_ns}".encode("utf-8", "surrogateescape"))
+        latest = max(latest, mtime_ns)
+    return digest.hexdigest(), datetime.fromtimestamp(latest // 1_000_000_000, tz=timezone.utc)
+
+
+def _not_modified_response(validator):
+    # 304 response if the client's copy of the page is current, None if the page has to be rendered
+    with PAGE_TAG_DIRS_LOCK:
+        tag_dirs = PAGE_TAG_DIRS.get(validator[0])
+        if tag_dirs is None:
+            return None   # not rendered by this process yet
+        PAGE_TAG_DIRS.move_to_end(validator[0])
+
+    etag, last_modified = _page_etag(validator=validator, tag_dirs=tag_dirs)
+    if request.if_none_match:   # takes precedence over If-Modified-Since
+        fresh = request.if_none_match.contains(etag)
+    else:
+        fresh = request.if_modified_since is not None and last_modified <= request.if_modified_since
+
+    if not fresh:
+        return None
+
+    response = make_response("", 304)
+    _set_page_validator(response=response, etag=etag, last_modified=last_modified)
+    key = request.cookies.get(SECRET_COOKIE_NAME)
+    if key:
+        set_secret_cookie(response=response, key=key)
+    return response
+
 
-    if tag_path.is_file():
-        return ("/" + tag_path.relative_to(NOTEBOOK_PATH).as_posix(), True)
+def _set_page_validator(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True   # always revalidate, instead of browsers caching by the age of Last-Modified
 
-    if tag_path.parent.is_dir():
-        for i in tag_path.parent.iterdir():
-            if i.is_file() and i.name.lower() == tag_path.name.lower():
-                return ("/" + i.relative_to(NOTEBOOK_PATH).as_posix(), True)
 
-    return ("/" + tag_path.relative_to(NOTEBOOK_PATH).as_posix(), False)
+def _remember_page_validator(response, validator, tagWikiPages):
+    # sets ETag and Last-Modified on a rendered page and remembers its tag page directories for the next conditional request
+    tag_dirs = tuple(sorted({str((NOTEBOOK_PATH / tag_page.lstrip("/")).parent) for tag_page, _ in tagWikiPages.values()}))
+    with PAGE_TAG_DIRS_LOCK:
+        PAGE_TAG_DIRS[validator[0]] = tag_dirs
+        PAGE_TAG_DIRS.move_to_end(validator[0])
+        while len(PAGE_TAG_DIRS) > PAGE_VALIDATORS_MAX:
+            PAGE_TAG_DIRS.popitem(last=False)
+
+    etag, last_modified = _page_etag(validator=validator, tag_dirs=tag_dirs)
+    _set_page_validator(response=response, etag=etag, last_modified=last_modified)
+
+
+def _set_page_cacheability(response, validator, tagWikiPages, backlinks_finished):
+    # a page rendered without its backlinks (deadline missed) gets no validator and is not stored, so that the next
+    # request renders it again instead of getting a 304 for the page without backlinks
+    if not backlinks_finished:
+        response.cache_control.no_store = True
+    elif validator is not None:
+        _remember_page_validator(response=response, validator=validator, tagWikiPages=tagWikiPages)
 
 
 def parseMarkdown(p, tagWikiPages):
+    # cached by page: the cached result is valid as long as the page file (st_mtime_ns, st_size) and
+    # the tag pages it links to (see _link_tag_pages) are unchanged
+    try:
+        st = p.stat()
+    except OSError:
+        return _parseMarkdown(p=p, tagWikiPages=tagWikiPages)
+    signature = (st.st_mtime_ns, st.st_size)
+    key = p.as_posix()
+
+    cached = PAGE_RENDER_CACHE.get(key)
+    if cached is not None:
+        cached_signature, (mypath_content, related_tags, mypath_tag, title, headings), tag_pages = cached
+        if cached_signature == signature:
+            for thetag, tag_page in tag_pages:
+                if thetag not in tagWikiPages:
+                    tagWikiPages[thetag] = _find_tag_wiki_page(tag=thetag)
+                if tagWikiPages[thetag] != tag_page:
+                    break
+            else:
+                return mypath_content, related_tags.keys(), mypath_tag, title, list(headings)
+
+    page_tag_pages = {}
+    mypath_content, related_tags, mypath_tag, title, headings = _parseMarkdown(p=p, tagWikiPages=page_tag_pages)
+    tagWikiPages.update(page_tag_pages)
+    PAGE_RENDER_CACHE.put(key=key, value=(signature, (mypath_content, dict.fromkeys(related_tags, True), mypath_tag, title, tuple(headings)), tuple(page_tag_pages.items())),
+                          tags=page_tag_pages.keys(), size=sys.getsizeof(mypath_content) + st.st_size)
+    return mypath_content, related_tags, mypath_tag, title, headings
+
+
+def _parseMarkdown(p, tagWikiPages):
     mypath_content = []
     mypath_tag = None
     related_tags = {}
@@ -348,6 +826,12 @@ def create_app():
             print(f"Registered blueprint: {url_prefix} -> {blueprint_path}")
 
 
+    @app.before_request
+    def revalidate_tag_pages():
+        # tag pages created or deleted since the last request are picked up on their next lookup
+        TAG_PAGE_INDEX.revalidate()
+
+
     @app.route('/', methods=['GET'])
     @app.route('/<path:mypath>', methods=['GET'])
     def index(mypath="/"):
@@ -370,6 +854,9 @@ def create_app():
         headings = []
 
         mypath_content = None
+        validator = None
+        backlinks_lookup = None
+        timings = {}
         if mypath != "_journal":
             p = NOTEBOOK_PATH / mypath
 
@@ -380,38 +867,46 @@ def create_app():
                 if (p / ".hidden").exists():
                     return "access denied."
 
-                folders = []
-                files = []
-                for child in p.iterdir():
-                    if HIDE_DOTFILES and child.name.startswith("."):
-                        continue
-                    if child.is_dir():
-                        folders.append(child)
-                    else:
-                        files.append(child)
+                sort = request.args.get('sort', 'name')
+                if sort not in FOLDER_SORT_KEYS:
+                    sort = 'name'
+                order = 'desc' if request.args.get('order', 'asc') == 'desc' else 'asc'
+                try:
+                    page = int(request.args.get('page', 1))
+                except ValueError:
+                    page = 1
 
-                folders.sort(key=lambda s: s.name.lower())
-                files.sort(key=lambda s: s.name.lower())
                 entries = []
                 if NOTEBOOK_PATH != p:
                     entries.append({"name": "..", "is_folder": True})
-
-                for the_folder in folders:
-                    entries.append({"name": the_folder.name, "is_folder": True, "absolute_path": "/" + the_folder.relative_to(NOTEBOOK_PATH).as_posix() + "/"})
-                for the_file in files:
-                    entries.append({"name": the_file.name, "is_folder": False, "absolute_path": "/" + the_file.relative_to(NOTEBOOK_PATH).as_posix(), "mtime": datetime.fromtimestamp(the_file.stat().st_mtime).strftime("%d.%m.%Y %H:%M")})
+                page_entries, page, page_count = _folder_listing(p=p, sort=sort, descending=order == 'desc', page=page)
+                entries.extend(page_entries)
 
                 delete_msg = request.args.get('delete_msg', '')
                 return render_template("folder.html",
                                     NOTEBOOK_NAME=NOTEBOOK_NAME,
                                     abs_path="/" + p.relative_to(NOTEBOOK_PATH).as_posix(),
                                     entries=entries,
+                                    sort=sort,
+                                    order=order,
+                                    page=page,
+                                    page_count=page_count,
                                     delete_msg=delete_msg,
                                     QUICKLAUNCH_HTML=QUICKLAUNCH_HTML,
                                     CUSTOM_HEADER_CONTENT=CUSTOM_HEADER_CONTENT)
 
             else:
 
+                page_file = p if p.is_file() or len(p.suffix) != 0 else p.parent / (p.name + MARKDOWN_SUFFIX)
+                if CONDITIONAL_PAGE_RESPONSES and page_file.suffix == MARKDOWN_SUFFIX:
+                    validator = _page_validator(page_file=page_file)
+                    not_modified = _not_modified_response(validator=validator)
+                    if not_modified is not None:
+                        return not_modified
+
+                if page_file.suffix == MARKDOWN_SUFFIX:   # overlapped with parsing and rendering, joined before the template is rendered
+                    backlinks_lookup = _start_backlinks(mypath if page_file == p else mypath + MARKDOWN_SUFFIX)
+
                 if p.is_file():
                     if p.suffix == MARKDOWN_SUFFIX:
                         mypath_content, related_tags, mypath_tag, title, headings = parseMarkdown(p=p, tagWikiPages=tagWikiPages)
@@ -431,7 +926,7 @@ def create_app():
 
 
             if INDEX_PAGE_NAME is not None and p.name == INDEX_PAGE_NAME and NO_JOURNAL_ENTRIES_ON_INDEX_PAGES:
-                backlinks = _get_backlinks(mypath)
+                backlinks, backlinks_finished = _join_backlinks(lookup=backlinks_lookup, timings=timings)
                 rendered_html = render_template(
                     "main.html",
                     NOTEBOOK_NAME=NOTEBOOK_NAME,
@@ -445,45 +940,43 @@ def create_app():
                     show_journal_entries=False
                 )
                 response = make_response(rendered_html)
+                response.headers["Server-Timing"] = _server_timing(timings)
+                _set_page_cacheability(response=response, validator=validator, tagWikiPages=tagWikiPages, backlinks_finished=backlinks_finished)
                 key = request.cookies.get(SECRET_COOKIE_NAME)
                 if key:
                     set_secret_cookie(response=response, key=key)
                 return response
 
 
-        today_date = datetime.now()
-        start_str = request.args.get('start', None)
-        stop_str = request.args.get('stop', None)
+        else:
+            if CONDITIONAL_PAGE_RESPONSES:
+                validator = _page_validator(page_file=None)
+                not_modified = _not_modified_response(validator=validator)
+                if not_modified is not None:
+                    return not_modified
 
-        # default start = today - DEFAULT_JOURNAL_TIMEWINDOW_IN_WEEKS weeks
-        default_start_date = today_date - timedelta(weeks=DEFAULT_JOURNAL_TIMEWINDOW_IN_WEEKS)
+            backlinks_lookup = _start_backlinks(mypath)
 
-        # If user provided a start date, try to parse it; otherwise use default
-        start_date = default_start_date
-        stop_date = today_date
-        if start_str is not None and len(start_str) != 0:
-            try:
-                parsed = datetime.strptime(start_str, '%Y-%m-%d')
-                start_date = parsed
-            except Exception:
-                start_date = default_start_date
-        if stop_str is not None and len(stop_str) != 0:
-            try:
-                parsed = datetime.strptime(stop_str, '%Y-%m-%d') + timedelta(days=1) - timedelta(microseconds=1)
-                stop_date = parsed
-            except Exception:
-                stop_date = today_date
+        today_date = datetime.now()
+        start_date, stop_date = _parse_window(start_str=request.args.get('start', None), stop_str=request.args.get('stop', None), today_date=today_date)
 
         # regex search param
         q = request.args.get('q', None)
         q = '' if q is None else q.strip()
 
         filtered_entries, regex_error = get_entries(start_date=start_date, stop_date=stop_date, related_tags=related_tags, selected_tags=selected_tags, q=q)
-        for e in filtered_entries:
-            econtent = []
-            for line in e["content"]:
-                econtent.append(TAG_REGEX.sub(lambda m: _link_tag_pages(m=m, tagWikiPages=tagWikiPages), line))
-            e["content"] = md.render("\n".join(econtent))
+        filtered_entries.sort(key=_entry_sort_key, reverse=True)
+
+        # only the first page is rendered, the rest is fetched from /_entries while scrolling; tag counts still cover all entries
+        query_state = {"start": start_date.isoformat(), "stop": stop_date.isoformat(), "related_tags": None if related_tags is None else list(related_tags),
+                       "selected_tags": selected_tags, "q": q}
+        page_entries, next_cursor = _journal_page(entries=filtered_entries, query_state=query_state)
+
+        def rendered_entries():
+            # rendered one at a time while the template is iterating over them (see STREAM_JOURNAL_PAGES)
+            for e in page_entries:
+                e["content"] = _render_entry(content=e["content"], tagWikiPages=tagWikiPages)
+                yield e
 
         tag_freshness = {}
         tag_counts = {}
@@ -506,6 +999,9 @@ def create_app():
         else:
             available_tags = sorted(available_tags, key=lambda at: (tag_freshness[at], at), reverse=True)
 
+        # available_tags includes every tag of page_entries (lowercased by findTags, as in _link_tag_pages), so tagWikiPages
+        # holds all tag pages the entries link to before they are rendered - possibly only while streaming, after
+        # _remember_page_validator below has already taken the tag page directories from tagWikiPages
         for a in available_tags:
             if a not in tagWikiPages:
                 tagWikiPages[a] = _find_tag_wiki_page(tag=a)
@@ -542,9 +1038,8 @@ def create_app():
 
         latest_journal_page = "/" + ((JOURNAL_PATH / (today_date.strftime("%Y-Q") + str((today_date.month - 1)//3 + 1) + MARKDOWN_SUFFIX)).relative_to(NOTEBOOK_PATH).as_posix())
 
-        backlinks = _get_backlinks(mypath)
-        rendered_html = render_template(
-            "main.html",
+        backlinks, backlinks_finished = _join_backlinks(lookup=backlinks_lookup, timings=timings)
+        template_context = dict(
             mypath=mypath,
             related_tags=related_tags,
             new_entry_tags_str=new_entry_tags_str,
@@ -554,7 +1049,9 @@ def create_app():
             mypath_content=mypath_content,
             headings=headings,
             JS_ENTRY_ID_FORMAT=JS_ENTRY_ID_FORMAT,
-            entries=filtered_entries,
+            entries=rendered_entries(),
+            next_cursor=next_cursor,
+            previous_week=None,
             all_tags=available_tags,
             tagWikiPages=tagWikiPages,
             selected_tags=selected_tags,
@@ -570,7 +1067,13 @@ def create_app():
             backlinks=backlinks,
             show_journal_entries=True
         )
-        response = make_response(rendered_html)
+        if STREAM_JOURNAL_PAGES:
+            # headers (including the cookie below) go out first, then the page as it is rendered
+            response = Response(_coalesce_chunks(stream_template("main.html", **template_context)), mimetype="text/html")
+        else:
+            response = make_response(render_template("main.html", **template_context))
+        response.headers["Server-Timing"] = _server_timing(timings)
+        _set_page_cacheability(response=response, validator=validator, tagWikiPages=tagWikiPages, backlinks_finished=backlinks_finished)
         key = request.cookies.get(SECRET_COOKIE_NAME)
         if key:
             set_secret_cookie(response=response, key=key)
@@ -808,22 +1311,147 @@ def create_app():
 
     @app.route("/_get_graph_data", methods=['GET'])
     def get_graph_data():
-        if BACKLINKS_SERVER_URL is not None:
-            url = BACKLINKS_SERVER_URL + "/__graph__data__"
-
+        if BACKLINK_ENGINE is not None:
             try:
-                with urllib.request.urlopen(url) as response:
-                    bytes_data = response.read()
-                    json_str = bytes_data.decode('utf-8')
-
-                    return jsonify({'ok': True, 'data': json.loads(json_str)})
+                return jsonify({'ok': True, 'data': BACKLINK_ENGINE.get_graph_data()})
+            except sqlite3.Error as e:
+                print(f"Failed to read backlinks: {e}")
 
+        if BACKLINKS_SERVER_URL is not None:
+            try:
+                return jsonify({'ok': True, 'data': _backlinks_server_get("/__graph__data__")})
             except Exception as e:
                 return jsonify({'error': 'failed', 'detail': str(e)}), 500
 
         return jsonify({'error': 'failed', 'detail': "backlinks server URL not configured"}), 500
 
 
+    @app.route("/_entries", methods=['GET'])
+    def journal_entries():
+        """Next page of journal entries for the cursor from the previous page, as HTML fragment or (format=json) JSON."""
+        if not check_secret():
+            return jsonify(ACCESS_DENIED_MESSAGE_DICT), 403
+
+        decoded = _decode_cursor(request.args.get('cursor', ''))
+        if decoded is None:
+            return jsonify({'error': 'invalid cursor'}), 400
+        query_state, after = decoded
+
+        following_entries = iter_entries_before(start_date=datetime.fromisoformat(query_state["start"]), stop_date=datetime.fromisoformat(query_state["stop"]),
+                                                related_tags=query_state["related_tags"], selected_tags=query_state["selected_tags"], q=query_state["q"], after=after)
+        page_entries, next_cursor = _journal_page(entries=following_entries, query_state=query_state)
+
+        tagWikiPages = {}
+        for e in page_entries:
+            e["content"] = _render_entry(content=e["content"], tagWikiPages=tagWikiPages)
+            for t in e["tags"]:
+                if t not in tagWikiPages:
+                    tagWikiPages[t] = _find_tag_wiki_page(tag=t)
+
+        if request.args.get('format') == 'json':
+            return jsonify({'ok': True,
+                            'next_cursor': next_cursor,
+                            'entries': [{'id': e.date.strftime(JS_ENTRY_ID_FORMAT),
+                                         'date': e.date.isoformat(),
+                                         'rel_path': "/" + e.rel_path.as_posix(),
+                                         'pos': e.pos,
+                                         'location': e.location,
+                                         'tags': e.tags,
+                                         'html': e.content} for e in page_entries]})
+
+        return render_template("entries.html",
+                               entries=page_entries,
+                               next_cursor=next_cursor,
+                               previous_week=after[0].isocalendar()[1],
+                               tagWikiPages=tagWikiPages,
+                               JS_ENTRY_ID_FORMAT=JS_ENTRY_ID_FORMAT,
+                               NO_ADDITIONAL_TAGS=NO_ADDITIONAL_TAGS)
+
+
+    @app.route("/_api/entries", methods=['GET'])
+    def api_entries():
+        """Streams the journal entries matching start, stop, tags and q (as on the journal page) as NDJSON, one entry per line.
+
+        content=raw (default) includes the markdown lines, content=rendered the HTML, content=none neither.
+        """
+        if not check_secret():
+            return jsonify(ACCESS_DENIED_MESSAGE_DICT), 403
+
+        start_date, stop_date = _parse_window(start_str=request.args.get('start', None), stop_str=request.args.get('stop', None), today_date=datetime.now())
+        selected_tags = request.args.getlist('tags')
+        content = request.args.get('content', 'raw')
+        if content not in ('raw', 'rendered', 'none'):
+            return jsonify({'error': 'invalid content, expected raw, rendered or none'}), 400
+
+        q = request.args.get('q', '').strip()
+        regex = None
+        if len(q) != 0:
+            try:
+                regex = re.compile(q, re.IGNORECASE)
+            except re.error as e:
+                return jsonify({'error': 'invalid regex: ' + str(e)}), 400
+
+        def generate():
+            tagWikiPages = {}
+            for e in iter_entries(start_date=start_date, stop_date=stop_date, selected_tags=selected_tags, regex=regex):
+                item = {'id': e.date.strftime(JS_ENTRY_ID_FORMAT),
+                        'date': e.date.isoformat(),
+                        'rel_path': "/" + e.rel_path.as_posix(),
+                        'pos': e.pos,
+                        'location': e.location,
+                        'tags': e.tags}
+                if content == 'raw':
+                    item['content'] = "\n".join(e.content)
+                elif content == 'rendered':
+                    item['html'] = _render_entry(content=e.content, tagWikiPages=tagWikiPages)
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
+
+    @app.route("/_cache_stats", methods=['GET'])
+    def cache_stats():
+        if not check_secret():
+            return jsonify(ACCESS_DENIED_MESSAGE_DICT), 403
+
+        return jsonify({'ok': True,
+                        'parse_cache': PARSE_CACHE.stats(),
+                        'render_cache': RENDER_CACHE.stats(),
+                        'page_render_cache': PAGE_RENDER_CACHE.stats(),
+                        'tag_page_index': TAG_PAGE_INDEX.stats(),
+                        'directory_snapshots': DIRECTORY_SNAPSHOTS.stats(),
+                        'journal_manifest': None if JOURNAL_MANIFEST is None else JOURNAL_MANIFEST.stats(),
+                        'entry_index': None if ENTRY_INDEX is None else ENTRY_INDEX.stats(),
+                        'search_index': None if SEARCH_INDEX is None else SEARCH_INDEX.stats()})
+
+
+    @app.route("/_search", methods=['GET'])
+    def search():
+        if not check_secret():
+            return jsonify(ACCESS_DENIED_MESSAGE_DICT), 403
+
+        if SEARCH_INDEX is None:
+            return jsonify({'error': 'search index not enabled (USE_SEARCH_INDEX)'}), 400
+
+        q = request.args.get('q', '').strip()
+        try:
+            limit = int(request.args.get('limit', 50))
+        except ValueError:
+            return jsonify({'error': 'invalid limit'}), 400
+
+        try:
+            (ENTRY_INDEX if ENTRY_INDEX is not None else JOURNAL_MANIFEST).refresh()
+            SEARCH_INDEX.refresh(journal_signatures=_journal_signatures())
+            results = SEARCH_INDEX.search(q=q, limit=limit)
+        except re.error as e:
+            return jsonify({'error': 'invalid regex', 'detail': str(e)}), 400
+
+        if results is None:
+            return jsonify({'error': 'query needs a literal of at least ' + str(SearchIndex.MIN_LITERAL_LENGTH) + ' characters'}), 400
+
+        return jsonify({'ok': True, 'results': results})
+
+
     @app.route("/_graph", methods=['GET'])
     def get_graph():
         return render_template("graph.html", NOTEBOOK_NAME=NOTEBOOK_NAME)
@@ -153,12 +153,9 @@ async function openInEditor(event, thetype, entryId){
 }
 
 
-document.addEventListener('DOMContentLoaded', function(){
-    // initial highlight pass and start watching for later changes
-    applyHighlights();
-
-    // double-click content to enter edit mode
-    document.querySelectorAll('.entry').forEach(el => {
+// click/double-click handlers of the journal entries below root
+function initEntries(root) {
+    root.querySelectorAll('.entry').forEach(el => {
         //el.addEventListener('dblclick', function(e){
         //    openInEditor(event=e, thetype="entry", entryId=el.getAttribute('id'))
         //});
@@ -170,8 +167,50 @@ document.addEventListener('DOMContentLoaded', function(){
             openInEditor(event=event, thetype="entry", entryId=el.getAttribute('id'))
         });
     });
+}
+
+// load the next page of journal entries from /_entries once the placeholder at the end comes into view
+function watchMoreEntries() {
+    const more = document.getElementById('entries-more');
+    if (!more) return;
+
+    const observer = new IntersectionObserver((observed) => {
+        if (observed.some(o => o.isIntersecting)) {
+            observer.disconnect();
+            loadMoreEntries(more);
+        }
+    }, { rootMargin: '1000px' });
+    observer.observe(more);
+}
+
+async function loadMoreEntries(more) {
+    try {
+        const resp = await fetch('/_entries?cursor=' + encodeURIComponent(more.dataset.cursor));
+        if (!resp.ok) {
+            more.textContent = 'Failed to load more entries: ' + resp.status;
+            return;
+        }
+        const container = document.createElement('div');
+        container.innerHTML = await resp.text();
+        initEntries(container);
+        more.replaceWith(...container.childNodes);
+        applyHighlights();
+        watchMoreEntries();
+    } catch (err) {
+        console.error(err);
+        more.textContent = 'Error loading more entries. See console.';
+    }
+}
+
+
+document.addEventListener('DOMContentLoaded', function(){
+    // initial highlight pass and start watching for later changes
+    applyHighlights();
+
+    // double-click content to enter edit mode
+    initEntries(document);
+    watchMoreEntries();
 
     // initialize the new event
     document.addEventListener('pointerup', detectDoubleTap(500));
 });
-
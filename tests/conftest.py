@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# noteslib and backlinkmonitor are imported as modules, like backlinkmonitor.py does when run as a script:
+# importing the notesserver package would import the Flask app
+sys.path.insert(0, (Path(__file__).resolve().parent.parent / "notesserver").as_posix())
@@ -0,0 +1,83 @@
+import os
+import shutil
+
+import pytest
+
+from backlinkmonitor import BacklinkEngine, BACKLINKS_FILENAME
+
+
+NOTES = {
+    "top.md": "[one](a/one.md) [two](a/two.md) xa_sub_four\n",
+    "a/one.md": "[two](two.md) [up](../top.md) [three](../b/three.md) xfoo\n",
+    "a/two.md": "[one](./one.md) [abs](/a/sub/four.md) [web](https://example.com/a/one.md)\n",
+    "a/sub/four.md": "[one](../one.md) [top](../../top.md) xa_one\n",
+    "b/three.md": "[one](../a/one.md) [four](../a/sub/four.md) xa\n",
+    "b/five.md": "no links, xbar\n",
+    "c/x.md": "[y](y.md) [z](sub/z.md) xbar\n",
+    "c/y.md": "[x](./x.md)\n",
+    "c/sub/z.md": "[x](../x.md) [y](/c/y.md)\n",
+}
+
+
+def _write_notebook(notebookpath):
+    for rel_path, content in NOTES.items():
+        (notebookpath / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (notebookpath / rel_path).write_text(content, encoding="utf-8")
+
+
+def _dump(engine):
+    conn = engine._connection()
+    files = {path for (path,) in conn.execute("SELECT path FROM files")}
+    links = set(conn.execute("""
+        SELECT files.path, tags.tag FROM backlinks
+        JOIN files ON files.id = backlinks.source
+        JOIN tags ON tags.id = backlinks.target"""))
+    return files, links
+
+
+def _resynced(notebookpath, tmp_path):
+    # the database a fresh sync of a copy of the notebook gives
+    copy = tmp_path / "resync"
+    shutil.copytree(notebookpath, copy, ignore=shutil.ignore_patterns(BACKLINKS_FILENAME + "*"))
+    engine = BacklinkEngine(copy, workers=1)
+    engine.catch_up()
+    return _dump(engine)
+
+
+@pytest.mark.parametrize("moves", [
+    [("a", "d", True)],
+    [("c", "e/c", True)],
+    [("a/sub", "b/sub", True)],
+    [("b/three.md", "a/three.md", False)],
+    [("top.md", "b/top.md", False)],
+    [("a/two.md", "a/sub/two.md", False), ("b", "a/b", True)],
+    [("a", "b/a", True), ("b/a/sub/four.md", "b/a/four.md", False)],
+])
+def test_move_matches_full_resync(tmp_path, moves):
+    notebookpath = tmp_path / "notebook"
+    notebookpath.mkdir()
+    _write_notebook(notebookpath)
+    engine = BacklinkEngine(notebookpath, workers=1)
+    engine.catch_up()
+
+    for src, dest, is_directory in moves:
+        (notebookpath / dest).parent.mkdir(parents=True, exist_ok=True)
+        os.rename(notebookpath / src, notebookpath / dest)
+        outdated = engine.move(src_path=notebookpath / src, dest_path=notebookpath / dest, is_directory=is_directory)
+        engine.sync_files(outdated)
+
+        assert _dump(engine) == _resynced(notebookpath, tmp_path)
+        shutil.rmtree(tmp_path / "resync")
+
+
+def test_move_onto_synced_file(tmp_path):
+    notebookpath = tmp_path / "notebook"
+    notebookpath.mkdir()
+    _write_notebook(notebookpath)
+    engine = BacklinkEngine(notebookpath, workers=1)
+    engine.catch_up()
+
+    os.replace(notebookpath / "b/five.md", notebookpath / "b/three.md")
+    engine.sync_files(engine.move(src_path=notebookpath / "b/five.md", dest_path=notebookpath / "b/three.md"))
+
+    assert _dump(engine) == _resynced(notebookpath, tmp_path)
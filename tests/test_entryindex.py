@@ -0,0 +1,117 @@
+import datetime
+import itertools
+import random
+import re
+
+import pytest
+
+from noteslib import EntryIndex
+
+
+WINDOW = (datetime.datetime(2000, 1, 1), datetime.datetime(2100, 1, 1))
+TAGS = ["xalpha", "xbeta", "xgamma_sub", "xStraße", "xdelta"]
+WORDS = ["Straße", "STRASSE", "ſign", "Sign", "kelvin", "K-rating", "plain", "note", "ﬁle", "FILE"]
+
+
+def _sort_key(e):
+    return e.date, e.rel_path.as_posix(), e.pos
+
+
+def _write_journal_file(thepath, rng):
+    # a journal file with many entries sharing their dates, to exercise the ordering of ties
+    lines = []
+    for _ in range(rng.randint(0, 12)):
+        date = datetime.datetime(2020, 1, rng.randint(1, 5), rng.choice([9, 12]))
+        lines.append(f"### {date:%Y-%m-%d %H:%M} {' '.join(rng.sample(TAGS, rng.randint(0, 2)))}")
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 6))))
+        lines.append("")
+    thepath.write_text("\n".join(lines), encoding="utf-8")
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journalpath = tmp_path / "journal"
+    journalpath.mkdir()
+    rng = random.Random(8)
+    for i in range(40):
+        _write_journal_file(journalpath / f"{i:02d}.md", rng)
+    return tmp_path, journalpath, rng
+
+
+def _state(index, **query):
+    return [(_sort_key(e), tuple(e.tags)) for e in sorted(index.query(*WINDOW, **query), key=_sort_key)]
+
+
+def test_merge_matches_full_sort(journal):
+    notebookpath, journalpath, rng = journal
+    index = EntryIndex(notebookpath=notebookpath, journalpath=journalpath, trigrams=False)
+    index.refresh()
+    index.query(*WINDOW)
+    merged = 0
+
+    for _ in range(300):
+        thepath = journalpath / f"{rng.randrange(45):02d}.md"
+        if thepath.exists() and rng.random() < 0.2:
+            thepath.unlink()
+            index.removeFile(thepath=thepath)
+        else:
+            _write_journal_file(thepath, rng)
+            index.updateFile(thepath=thepath)
+
+        entries = index._entries
+        dates = [e.date for e in index.query(*WINDOW)]
+        merged += index._entries is entries   # merged in place rather than sorted again
+        assert dates == sorted(dates)
+        assert index._dates == [e.date for e in index._entries]
+
+        fresh = EntryIndex(notebookpath=notebookpath, journalpath=journalpath, trigrams=False)
+        fresh.refresh()
+        assert _state(index) == _state(fresh)
+        assert _state(index, any_tags=["xgamma"]) == _state(fresh, any_tags=["xgamma"])
+        assert _state(index, all_tags=["xalpha", "xbeta"]) == _state(fresh, all_tags=["xalpha", "xbeta"])
+
+    assert merged > 200
+
+
+@pytest.mark.parametrize("query", [{}, {"any_tags": ["xalpha"]}, {"all_tags": ["xbeta"]}, {"pattern": "plain"}])
+@pytest.mark.parametrize("page_size", [1, 7, 50])
+def test_cursor_paging_returns_every_entry_once(journal, query, page_size):
+    notebookpath, journalpath, _ = journal
+    index = EntryIndex(notebookpath=notebookpath, journalpath=journalpath)
+    index.refresh()
+    expected = [_sort_key(e) for e in sorted(index.query(*WINDOW, **query), key=_sort_key, reverse=True)]
+
+    paged = []
+    after = None
+    while True:
+        page = list(itertools.islice(index.iterBefore(*WINDOW, key=_sort_key, before=after, **query), page_size))
+        if len(page) == 0:
+            break
+        paged.extend(_sort_key(e) for e in page)
+        after = paged[-1]
+
+    assert paged == expected
+    assert len(set(paged)) == len(paged)
+
+
+def test_iter_before_copies(journal):
+    notebookpath, journalpath, _ = journal
+    index = EntryIndex(notebookpath=notebookpath, journalpath=journalpath)
+    index.refresh()
+    for e in index.iterBefore(*WINDOW, key=_sort_key):
+        e["tags"].append("changed")
+    assert all("changed" not in e.tags for e in index.query(*WINDOW))
+
+
+@pytest.mark.parametrize("pattern", ["straße", "STRASSE", "sign", "ſign", "k-rating", "K-rating", "file", "ﬁle",
+                                     "pla(in|ne)", "no?te", "(?:kelvin|Sign)x?", "[st]ign"])
+def test_trigram_prefilter_keeps_regex_matches(journal, pattern):
+    notebookpath, journalpath, _ = journal
+    index = EntryIndex(notebookpath=notebookpath, journalpath=journalpath)
+    index.refresh()
+    regex = re.compile(pattern, re.IGNORECASE)
+
+    def matching(entries):
+        return sorted(_sort_key(e) for e in entries if any(regex.search(line) for line in e.content))
+
+    assert matching(index.query(*WINDOW, pattern=pattern)) == matching(index.query(*WINDOW))
@@ -0,0 +1,55 @@
+import re
+
+import pytest
+
+from noteslib import SearchIndex, iterEntries
+
+
+JOURNAL = """### 2020-01-01 10:00 xtravel
+İstanbul, Straße and STRASSE
+
+### 2020-01-02 10:00
+ſign at 10 K (kelvin), ΣΊΣΥΦΟΣ
+
+### 2020-01-03 10:00
+µmeter and the ﬁle, plain ASCII text
+"""
+
+PATTERNS = ["istanbul", "İSTANBUL", "straße", "strasse", "STRASSE", "sign", "ſign", "k \\(kelvin", "σίσυφος", "μmeter",
+            "file", "ﬁle", "plain|nothing", "(straße|sign)", "ascii te?xt"]
+
+
+@pytest.fixture
+def index(tmp_path):
+    journalpath = tmp_path / "journal"
+    journalpath.mkdir()
+    (journalpath / "2020-Q1.md").write_text(JOURNAL, encoding="utf-8")
+    (tmp_path / "page.md").write_text("İstanbul and ſign on a wiki page\n", encoding="utf-8")
+    search_index = SearchIndex(notebookpath=tmp_path, journalpath=journalpath)
+    search_index.refresh()
+    return tmp_path, journalpath, search_index
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_candidates_keep_regex_matches(index, pattern):
+    notebookpath, journalpath, search_index = index
+    regex = re.compile(pattern, re.IGNORECASE)
+    matching = {("/" + e.rel_path.as_posix(), e.pos) for e in iterEntries(thepath=journalpath / "2020-Q1.md", notebookpath=notebookpath)
+                if any(regex.search(line) for line in e.content)}
+
+    candidates = search_index.candidates(pattern)
+    assert candidates is None or matching <= candidates
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_search_matches_scan(index, pattern):
+    _, _, search_index = index
+    found = search_index.search(pattern)
+    if found is None:   # no literal of MIN_LITERAL_LENGTH characters
+        return
+    scanned = search_index._scan(regex=re.compile(pattern, re.IGNORECASE), limit=50)
+
+    def key(result):
+        return result["path"], result["pos"], tuple(result["offsets"]), result["snippet"]
+
+    assert sorted(map(key, found)) == sorted(map(key, scanned))
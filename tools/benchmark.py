@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import sys
+import re
+import argparse
+import random
+import tempfile
+import time
+import tracemalloc
+import os
+import io
+import contextlib
+import sqlite3
+from pathlib import Path
+from datetime import datetime, timedelta
+
+sys.path.insert(0, (Path(__file__).resolve().parent.parent / "notesserver").as_posix())
+import noteslib   # noqa: E402
+import backlinkmonitor   # noqa: E402
+
+
+WORDS = ["meeting", "notes", "idea", "project", "review", "call", "draft", "budget", "plan", "todo", "bike", "family", "research", "paper"]
+TAGS = ["inbox", "research", "family", "bike", "work_meetings", "work_projects", "ideas", "reading"]
+
+
+def generate_notebook(notebookpath, years=10, entries_per_day=3, lines_per_entry=6, seed=42, files=None):
+    """Writes a synthetic notebook with one journal file per quarter (or the entries spread over `files` files), returns the list of journal files."""
+    rnd = random.Random(seed)
+    journalpath = notebookpath / "journal"
+    journalpath.mkdir(parents=True, exist_ok=True)
+
+    journal_lines = {}
+    start = datetime(2030 - years, 1, 1, 8, 0, 0)
+    for day in range(years * 365):
+        thedate = start + timedelta(days=day)
+        for e in range(entries_per_day):
+            if files is None:
+                journal_file = journalpath / (thedate.strftime("%Y") + "-Q" + str(((thedate.month - 1) // 3) + 1) + noteslib.MARKDOWN_SUFFIX)
+            else:
+                i = (day * entries_per_day + e) % files
+                journal_file = journalpath / f"{i // 100:03d}" / (f"{i:05d}" + noteslib.MARKDOWN_SUFFIX)
+            lines = journal_lines.setdefault(journal_file, ["# " + journal_file.stem, ""])
+            entrydate = thedate + timedelta(hours=e * 3, minutes=rnd.randint(0, 59))
+            lines.append(noteslib.ENTRY_PREFIX + entrydate.strftime("%Y-%m-%d %H:%M:%S") + " " + " ".join(rnd.choices(WORDS, k=4)))
+            lines.append("tags: " + " ".join(noteslib.TAG_PREFIX + t for t in rnd.sample(TAGS, k=2)))
+            for _ in range(lines_per_entry - 2):
+                lines.append(" ".join(rnd.choices(WORDS, k=10)) + " [link](./other.md)")
+            lines.append("")
+
+    for journal_file, lines in journal_lines.items():
+        journal_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(journal_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    return sorted(journal_lines.keys())
+
+
+def _legacy_entry(e):
+    # the dict parseEntries returned per entry before Entry: rel_path, location and anchorlocation computed up front
+    rel_path = e.rel_path
+    return {"date": e.date,
+            "content": e.content,
+            "tags": e.tags,
+            "pos": e.pos,
+            "rel_path": rel_path,
+            "location": ("/" + rel_path.as_posix() + "#L" + str(e.pos)),
+            "anchorlocation": ("/" + rel_path.as_posix() + "#" + noteslib._get_anchor(e._headline))}
+
+
+def bench_memory(notebookpath, journal_files):
+    def retained(convert):
+        # memory retained by the parsed entries of all journal files, each converted by convert, and the number of entries
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        parsed = []
+        for journal_file in journal_files:
+            parsed.append([convert(e) for e in noteslib.parseEntries(thepath=journal_file, notebookpath=notebookpath)["entries"]])
+        current = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        return current, sum(len(entries) for entries in parsed)
+
+    before, entry_count = retained(_legacy_entry)
+    after, _ = retained(lambda e: e)
+
+    print(f"entries: {entry_count}")
+    print(f"retained memory, dict per entry: {before / (1024 * 1024):.1f} MiB ({before / entry_count:.0f} bytes/entry)")
+    print(f"retained memory, Entry:          {after / (1024 * 1024):.1f} MiB ({after / entry_count:.0f} bytes/entry), "
+          f"{(1 - after / before) * 100:.0f}% less")
+
+
+def bench_parse(notebookpath, journal_files):
+    line_count = 0
+    byte_count = 0
+    for journal_file in journal_files:
+        byte_count += journal_file.stat().st_size
+        with open(journal_file, "r", encoding="utf-8") as f:
+            line_count += sum(1 for _ in f)
+
+    t0 = time.perf_counter()
+    for journal_file in journal_files:
+        noteslib.parseEntries(thepath=journal_file, notebookpath=notebookpath, date_format="%a %d.%m. %H:%M")
+    elapsed = time.perf_counter() - t0
+
+    print(f"parsed {line_count} lines ({byte_count / (1024 * 1024):.1f} MiB) in {elapsed:.2f}s: {line_count / elapsed:.0f} lines/sec")
+
+
+def bench_scan(notebookpath, journal_files):
+    big_journal = notebookpath / "journal" / "all.md"
+    with open(big_journal, "w", encoding="utf-8") as bf:
+        for journal_file in journal_files:
+            with open(journal_file, "r", encoding="utf-8") as f:
+                bf.write(f.read())
+
+    last_date = None
+    for entry in noteslib.iterEntries(thepath=big_journal, notebookpath=notebookpath, headers_only=True):
+        last_date = entry.date
+    stop_date = last_date
+    start_date = stop_date - timedelta(weeks=2)
+
+    t0 = time.perf_counter()
+    parsed = [e for e in noteslib.iterEntries(thepath=big_journal, notebookpath=notebookpath) if start_date <= e.date <= stop_date]
+    t_parse = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    scanned = list(noteslib.scanEntries(thepath=big_journal, notebookpath=notebookpath, start_date=start_date, stop_date=stop_date))
+    t_scan = time.perf_counter() - t0
+
+    assert [(e.date, e.content, e.tags, e.pos) for e in parsed] == [(e.date, e.content, e.tags, e.pos) for e in scanned]
+    print(f"two-week window ({len(scanned)} entries) of a {big_journal.stat().st_size / (1024 * 1024):.1f} MiB journal: "
+          f"full parse {t_parse * 1000:.0f} ms, mmap scan {t_scan * 1000:.0f} ms")
+
+
+def bench_coldstart(notebookpath, journal_files):
+    def first_request(cache):
+        # what get_entries does for a window covering the whole notebook
+        t0 = time.perf_counter()
+        count = 0
+        for journal_file in journal_files:
+            count += len(cache.entries(thepath=journal_file, notebookpath=notebookpath, date_format="%a %d.%m. %H:%M"))
+        return count, time.perf_counter() - t0
+
+    count, t_nosnapshot = first_request(noteslib.ParseCache(max_bytes=1024 * 1024 * 1024))
+    snapshot = noteslib.ParseSnapshot(notebookpath=notebookpath)
+    _, t_build = first_request(noteslib.ParseCache(max_bytes=1024 * 1024 * 1024, snapshot=snapshot))
+    t0 = time.perf_counter()
+    restarted = noteslib.ParseCache(max_bytes=1024 * 1024 * 1024, snapshot=noteslib.ParseSnapshot(notebookpath=notebookpath))
+    first_request(restarted)
+    t_snapshot = time.perf_counter() - t0
+
+    print(f"first request over {count} entries after a restart: without snapshot {t_nosnapshot:.2f}s, "
+          f"with snapshot {t_snapshot:.2f}s (building the snapshot: {t_build:.2f}s, "
+          f"{snapshot.db_path.stat().st_size / (1024 * 1024):.1f} MiB)")
+
+
+def bench_query(notebookpath, journal_files):
+    last_date = max(e.date for e in noteslib.iterEntries(thepath=journal_files[-1], notebookpath=notebookpath, headers_only=True))
+    queries = [("two weeks", last_date - timedelta(weeks=2), None),
+               ("two weeks, tag", last_date - timedelta(weeks=2), ["work"]),
+               ("all years, tag", datetime.min, ["work"])]
+
+    cache = noteslib.ParseCache(max_bytes=1024 * 1024 * 1024)
+    index = noteslib.EntryIndex(notebookpath=notebookpath, journalpath=notebookpath / "journal")
+    index.refresh()
+    index.query(start_date=last_date, stop_date=last_date)
+
+    def linear(start_date, related_tags):
+        # warm ParseCache over all files plus the linear tag filter of get_entries
+        result = []
+        for journal_file in journal_files:
+            result.extend(cache.entries(thepath=journal_file, notebookpath=notebookpath, start_date=start_date, stop_date=last_date))
+        if related_tags is not None:
+            result = [e for e in result if any(t == rt or t.startswith(rt + noteslib.TAG_NAMESPACE_SEPARATOR) for rt in related_tags for t in e.tags)]
+        return result
+
+    for name, start_date, related_tags in queries:
+        linear(start_date, related_tags)
+        t0 = time.perf_counter()
+        n_linear = len(linear(start_date, related_tags))
+        t_linear = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        index.refresh()
+        t_refresh = time.perf_counter() - t0
+        n_index = len(index.query(start_date=start_date, stop_date=last_date, any_tags=related_tags))
+        t_index = time.perf_counter() - t0 - t_refresh
+
+        assert n_linear == n_index
+        print(f"{name} ({n_index} entries): parse cache + linear filter {t_linear * 1000:.1f} ms, "
+              f"EntryIndex {t_index * 1000:.1f} ms (+ {t_refresh * 1000:.1f} ms refresh)")
+
+
+def bench_regex(notebookpath, journal_files):
+    queries = ["budget", "research paper", "draft|todo", "(idea|plan) review", r"\bbike\b.*family", "2027-03-1[0-9]", "bike bike bike", "xyzzy"]
+
+    index = noteslib.EntryIndex(notebookpath=notebookpath, journalpath=notebookpath / "journal")
+    index.refresh()
+    everything = index.query(start_date=datetime.min, stop_date=datetime.max)
+    t0 = time.perf_counter()
+    index.query(start_date=datetime.min, stop_date=datetime.max, pattern="warmup")
+    t_build = time.perf_counter() - t0
+    print(f"trigram index over {len(everything)} entries built in {t_build:.2f}s ({index.stats()['trigrams']} trigrams)")
+
+    def matching(entries, regex):
+        return [e for e in entries if any(regex.search(line) for line in e.content)]
+
+    for q in queries:
+        regex = re.compile(q, re.IGNORECASE)
+        t0 = time.perf_counter()
+        n_scan = len(matching(index.query(start_date=datetime.min, stop_date=datetime.max), regex))
+        t_scan = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        candidates = index.query(start_date=datetime.min, stop_date=datetime.max, pattern=q)
+        n_trigram = len(matching(candidates, regex))
+        t_trigram = time.perf_counter() - t0
+
+        assert n_scan == n_trigram
+        print(f"{q!r} ({n_trigram} matches): full scan {t_scan * 1000:.0f} ms, "
+              f"trigram prefilter {t_trigram * 1000:.0f} ms ({len(candidates)} candidates)")
+
+
+def bench_parallel(tmpdir, years, entries_per_day, workers):
+    for file_count in (100, 1000, 10000):
+        notebookpath = tmpdir / f"parallel{file_count}"
+        journal_files = generate_notebook(notebookpath=notebookpath, years=years, entries_per_day=entries_per_day, files=file_count)
+        size = sum(f.stat().st_size for f in journal_files)
+
+        timings = []
+        for w in (1, workers):
+            t0 = time.perf_counter()
+            count = sum(len(entries) for _, entries, _ in noteslib.parseFiles(paths=journal_files, notebookpath=notebookpath, workers=w))
+            timings.append(time.perf_counter() - t0)
+
+        print(f"{len(journal_files)} files ({size / (1024 * 1024):.1f} MiB, {count} entries): serial {timings[0]:.2f}s, "
+              f"{workers or 'one per CPU'} workers {timings[1]:.2f}s")
+
+
+def _v1_sync(db_path, abs_path, mtime, links):
+    # BacklinkEngine.sync_file of the version 1_2 schema: a connection per file, an INSERT per link
+    with sqlite3.connect(db_path) as conn:
+        row = conn.execute("SELECT last_mtime FROM files WHERE path = ?", (abs_path,)).fetchone()
+        if row and row[0] >= mtime:
+            return
+        conn.execute("DELETE FROM backlinks WHERE source = ?", (abs_path,))
+        for link in links:
+            conn.execute("INSERT OR IGNORE INTO backlinks (source, target) VALUES (?, ?)", (abs_path, link.lower()))
+        conn.execute("INSERT OR REPLACE INTO files (path, last_mtime) VALUES (?, ?)", (abs_path, mtime))
+
+
+def bench_backlinks(tmpdir, file_count=5000, links_per_file=10, tag_count=2000, lookups=1000):
+    rnd = random.Random(42)
+    notebookpath = tmpdir / "backlinks"
+    notebookpath.mkdir()
+    files = []
+    for i in range(file_count):
+        md_file = notebookpath / f"{i // 100:03d}" / (f"{i:05d}" + noteslib.MARKDOWN_SUFFIX)
+        md_file.parent.mkdir(exist_ok=True)
+        md_file.write_text("\n")
+        files.append((md_file, {f"tag{rnd.randrange(tag_count)}" for _ in range(links_per_file)}))
+    edges = sum(len(links) for _, links in files)
+    changed = rnd.sample(files, k=file_count // 10)
+    targets = [f"tag{rnd.randrange(tag_count)}" for _ in range(lookups)]
+
+    v1_path = tmpdir / "v1.sqlite"
+    with sqlite3.connect(v1_path) as conn:
+        conn.execute("CREATE TABLE files (path TEXT PRIMARY KEY, last_mtime REAL)")
+        conn.execute("CREATE TABLE backlinks (source TEXT, target TEXT, PRIMARY KEY (source, target))")
+
+    def v1_sync(batch):
+        for md_file, links in batch:
+            _v1_sync(v1_path, "/" + md_file.relative_to(notebookpath).as_posix(), md_file.stat().st_mtime, links)
+
+    def v1_lookups():
+        with sqlite3.connect(v1_path) as conn:
+            for target in targets:
+                conn.execute("SELECT source FROM backlinks WHERE target = ?", (target,)).fetchall()
+
+    engine = backlinkmonitor.BacklinkEngine(notebookpath=notebookpath)
+
+    def v2_sync(batch):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for md_file, links in batch:
+                engine.sync_file(md_file, links=links)
+
+    def v2_lookups():
+        for target in targets:
+            engine.get_backlinks(target)
+
+    def timed(f, *args):
+        t0 = time.perf_counter()
+        f(*args)
+        return time.perf_counter() - t0
+
+    full = (timed(v1_sync, files), timed(v2_sync, files))
+    for md_file, _ in changed:
+        os.utime(md_file, (md_file.stat().st_atime, md_file.stat().st_mtime + 10))
+    resync = (timed(v1_sync, changed), timed(v2_sync, changed))
+    lookup = (timed(v1_lookups), timed(v2_lookups))
+
+    print(f"{file_count} files, {edges} edges, {tag_count} tags")
+    print(f"initial sync:         v1_2 {full[0]:.2f}s, v{backlinkmonitor.DB_VERSION} {full[1]:.2f}s")
+    print(f"re-sync {len(changed)} files:    v1_2 {resync[0]:.2f}s, v{backlinkmonitor.DB_VERSION} {resync[1]:.2f}s")
+    print(f"{lookups} lookups:         v1_2 {lookup[0] * 1000:.0f} ms, v{backlinkmonitor.DB_VERSION} {lookup[1] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="noteslib benchmarks on a synthetic notebook")
+    parser.add_argument("benchmark", choices=["memory", "parse", "scan", "coldstart", "query", "regex", "parallel", "backlinks"])
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--entries-per-day", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes for the parallel benchmark (default: one per CPU)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.benchmark == "parallel":
+            bench_parallel(tmpdir=Path(tmpdir).resolve(), years=args.years, entries_per_day=args.entries_per_day, workers=args.workers)
+            sys.exit(0)
+        if args.benchmark == "backlinks":
+            bench_backlinks(tmpdir=Path(tmpdir).resolve())
+            sys.exit(0)
+
+        notebookpath = Path(tmpdir).resolve()
+        t0 = time.perf_counter()
+        journal_files = generate_notebook(notebookpath=notebookpath, years=args.years, entries_per_day=args.entries_per_day)
+        print(f"generated {len(journal_files)} journal files in {time.perf_counter() - t0:.1f}s")
+
+        if args.benchmark == "memory":
+            bench_memory(notebookpath=notebookpath, journal_files=journal_files)
+        elif args.benchmark == "parse":
+            bench_parse(notebookpath=notebookpath, journal_files=journal_files)
+        elif args.benchmark == "scan":
+            bench_scan(notebookpath=notebookpath, journal_files=journal_files)
+        elif args.benchmark == "coldstart":
+            bench_coldstart(notebookpath=notebookpath, journal_files=journal_files)
+        elif args.benchmark == "query":
+            bench_query(notebookpath=notebookpath, journal_files=journal_files)
+        elif args.benchmark == "regex":
+            bench_regex(notebookpath=notebookpath, journal_files=journal_files)